@@ -0,0 +1,49 @@
+# Measures proof of work hashes per second, before and after the midstate search
+# Usage: python benchmark.py [miner file] [number of nonces]
+import importlib.util
+import sys
+from time import perf_counter
+
+def load_miner(path):
+    spec = importlib.util.spec_from_file_location('miner', path)
+    miner = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(miner)
+    return miner
+
+def search_all(Blockchain, last_proof, nonces):
+    # Every valid proof among the first nonces, continuing the search after each one
+    found = []
+    start = 0
+    while True:
+        proof = Blockchain.search_proofs(last_proof, start, nonces)
+        if proof is None:
+            return found
+        found.append(proof)
+        start = proof + 1
+
+def hashrate(search, nonces):
+    start = perf_counter()
+    search(nonces)
+    return nonces / (perf_counter() - start)
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else 'miner-1.py'
+    nonces = int(sys.argv[2]) if len(sys.argv) > 2 else 1000000
+    Blockchain = load_miner(path).Blockchain
+    last_proof = 35293
+
+    # Both searches must accept exactly the same proofs
+    expected = [p for p in range(200000) if Blockchain.valid_proof(last_proof, p)]
+    assert search_all(Blockchain, last_proof, 200000) == expected, 'search_proofs and valid_proof disagree'
+
+    def before(n):
+        for proof in range(n):
+            Blockchain.valid_proof(last_proof, proof)
+
+    def after(n):
+        search_all(Blockchain, last_proof, n)
+
+    rate_before = hashrate(before, nonces)
+    rate_after = hashrate(after, nonces)
+    print(f'valid_proof loop: {rate_before:,.0f} hashes/s')
+    print(f'search_proofs:    {rate_after:,.0f} hashes/s ({rate_after / rate_before:.2f}x)')
@@ -1,32 +1,85 @@
 import datetime
 import hashlib
+import atexit
 import json
+import logging
 from textwrap import dedent
 from time import time
 from uuid import uuid4
 from urllib.parse import urlparse
 import requests
-from flask import Flask, jsonify, request
+from requests.adapters import HTTPAdapter
+from flask import Flask, Response, jsonify, request
 import binascii
-from typing import List
+import codecs
+import collections
+import functools
+import gc
+import heapq
+import math
+import mmap
+import multiprocessing
+import os
+import queue
+import re
+import sqlite3
+import struct
+import threading
+import zlib
+from array import array
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from typing import Dict, List, Optional, Set, Tuple
 import typing
 
 # following imports are required by PKI
 import Crypto
 import Crypto.Random
 from Crypto.Hash import SHA
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import PKCS1_v1_5, eddsa
+
+logger = logging.getLogger(__name__)
+
+# A proof is valid when its hash, read as a 256 bit number, is below the target.
+# This accepts exactly the hashes whose hex digest starts with "0000"
+PROOF_TARGET = (1 << 240).to_bytes(32, 'big')
+
+# Transactions ingested in bulk are admitted to the mempool this many at a time
+INGEST_BATCH_SIZE = 1000
+
+# Blocks with at least this many transactions have them hashed across worker processes
+PARALLEL_HASHING_THRESHOLD = 10000
 
 class Blockchain(object):
 
-    def __init__(self):
-        self.current_transactions = []
-        self.chain = []
+    def __init__(self, log_path=None):
         self.nodes = set()
+        self.listeners = []
+        self.lock = threading.RLock()
+
+        # Transactions waiting to be mined, taken into blocks by arrival or by fee, one of BLOCK_ORDERS
+        self.mempool = Mempool()
+        self.block_order = 'arrival'
+
+        # Peers are fetched concurrently over pooled, kept-alive connections
+        self.peer_timeout = 5
+        self.peer_executor = ThreadPoolExecutor(max_workers=32)
+        self.session = requests.Session()
+        self.session.mount('http://', HTTPAdapter(pool_connections=32, pool_maxsize=32))
+
+        # The chain is kept in an append-only log on disk, and reloaded from it on restart.
+        # Only the headers are held in memory, the transactions are read back from the log
+        self.block_log = BlockLog(log_path) if log_path else None
+        # The loaded headers all live until shutdown, so the garbage collector is paused while they are indexed
+        gc.disable()
+        try:
+            self.chain = ColumnarChain(self.block_log)
+        finally:
+            gc.enable()
 
         #create the genesis block
-        self.new_block(previous_hash = 1, proof = 100) 
+        if not self.chain:
+            self.new_block(previous_hash = 1, proof = 100) 
         
         # Generate a Private Key
         random = Crypto.Random.new().read
@@ -49,42 +102,119 @@ class Blockchain(object):
         :return <dict> New Block
         """
 
-        tmp = ["0"]
-        mtree = MerkleTree(tmp)
-
-        block = {
-            'index': len(self.chain) + 1,
-            'timestamp': time(),
-            'transactions': self.current_transactions,
-            'proof': proof,
-            'previous_hash': previous_hash or self.hash(self.chain[-1]),
-            'merkle_root': MerkleTree(tmp).getRootHash()
-        }
-
-        #Reset the current list of transactions
-        self.current_transactions = []
-
-        #append the newly created block to the chain
-        self.chain.append(block)
+        with self.lock:
+            transaction_hashes, transactions = self.mempool.template(self.block_order)
+
+            # In arrival order, the Merkle Tree was built as the transactions arrived
+            if not transactions:
+                merkle_root = self.merkle_root([])
+            elif self.block_order == 'arrival':
+                merkle_root = self.mempool.merkle_root()
+            else:
+                merkle_root = self.merkle_root(transaction_hashes)
+
+            block = {
+                'index': len(self.chain) + 1,
+                'timestamp': time(),
+                'transactions': transactions,
+                'transaction_hashes': transaction_hashes,
+                'proof': proof,
+                'previous_hash': previous_hash or self.hash(self.chain[-1]),
+                'merkle_root': merkle_root
+            }
+
+            # Seal the block with its hash, so it is never hashed again
+            block['hash'] = self.hash(block)
+
+            #Reset the current list of transactions
+            self.mempool.clear()
+
+            #append the newly created block to the chain
+            self.chain.append(block)
+            self.notify(len(self.chain) - 1, [block])
         return block
 
-    def new_transaction(self, sender, recipient, amount):
+    def new_transaction(self, sender, recipient, amount, fee=0, nonce=None):
         #adds a new transaction to the list of transactions
         """
         Creates a new transaction to go into the next mined block
         :param sender: <str> Address of the sender
         :param recipient: <str> Address of the recipient
         :param amount: <int> Amount
-        :return <int> The index of the block that will hold this transaction
+        :param fee: (Optional) <int> Fee paid to the miner, which decides what a full mempool keeps
+        :param nonce: (Optional) <int> 64 bit number that makes the transaction unique, random if not given.
+                      A client that resends a transaction with the same nonce has it rejected as a duplicate
+        :return <int> The index of the block that will hold this transaction, or None if the
+                mempool rejected it as a duplicate or for a fee too low while it is full
         """
         
-        self.current_transactions.append({
-            'sender' : sender,
-            'recipient': recipient,
-            'amount': amount
-        })
+        return self.new_transactions([(sender, recipient, amount, fee, nonce)])[0]
+
+    def new_transactions(self, transactions):
+        """
+        Creates a batch of new transactions, admitting them to the mempool under a single lock
+        :param transactions: <list> (sender, recipient, amount, fee, nonce) of each transaction, nonce None for a random one
+        :return <list> For each transaction, the index of the block that will hold it, or None if the mempool rejected it
+        """
+
+        prepared = []
+        for sender, recipient, amount, fee, nonce in transactions:
+            # The nonce gives a repeated payment its own hash, and so outputs of its own
+            transaction = {
+                'sender' : sender,
+                'recipient': recipient,
+                'amount': amount,
+                'nonce': nonce if nonce is not None else int.from_bytes(os.urandom(8), 'big'),
+            }
+            if fee:
+                transaction['fee'] = fee
+            encoded = encode_transaction(transaction)
+            prepared.append((hashlib.sha256(encoded).hexdigest(), transaction, fee, len(encoded)))
+
+        with self.lock:
+            index = self.last_block['index'] + 1
+            return [index if self.mempool.add(*entry) else None for entry in prepared]
+
+    def new_signed_transactions(self, transactions):
+        """
+        Admits a batch of signed transactions to the mempool under a single lock, as their senders
+        signed them, with the outputs they spend and create. The caller has checked their signatures
+        and their inputs, and names the sender of each by its wallet address
+        :param transactions: <list> Transactions, with their sender, input_transactions and output_transactions
+        :return <list> For each transaction, the index of the block that will hold it, or None if the mempool rejected it
+        """
+
+        prepared = []
+        for transaction in transactions:
+            encoded = encode_transaction(transaction)
+            prepared.append((hashlib.sha256(encoded).hexdigest(), transaction, transaction.get('fee', 0), len(encoded)))
+
+        with self.lock:
+            index = self.last_block['index'] + 1
+            return [index if self.mempool.add(*entry) else None for entry in prepared]
+
+    def new_reward(self, recipient, amount):
+        """
+        Creates the reward transaction of the next mined block. The sender is "0" to signify
+        that a new coin is mined, and the reward names the block it is paid in, so that
+        no two rewards share a hash and each has outputs of its own
+        :param recipient: <str> Address of the miner
+        :param amount: <int> Amount
+        :return <int> The index of the block that will hold the reward
+        """
 
-        return self.last_block['index'] + 1
+        with self.lock:
+            index = self.last_block['index'] + 1
+            transaction = {
+                'sender': "0",
+                'recipient': recipient,
+                'amount': amount,
+                'block': index,
+            }
+            # pinned, so that a full mempool can neither turn the reward away nor evict it before the block is forged
+            encoded = encode_transaction(transaction)
+            self.mempool.add(hashlib.sha256(encoded).hexdigest(), transaction, size=len(encoded), pinned=True)
+            return index
 
     def register_node(self, address):
         """
@@ -96,37 +226,154 @@ class Blockchain(object):
         parsed_url = urlparse(address)
         self.nodes.add(parsed_url.netloc)
 
+    def subscribe(self, listener):
+        """
+        Register a callback for changes to the tip of the chain
+        :param listener: <callable> Called as listener(fork, blocks) once the blocks from height fork
+                         onwards have been replaced by blocks; a new block is listener(len(chain) - 1, [block])
+        :return: None
+        """
+
+        self.listeners.append(listener)
+
+    def notify(self, fork, blocks):
+        for listener in self.listeners:
+            listener(fork, blocks)
+
     @staticmethod
     def hash(block):
         #Hashes a block
         """
-        Creates a SHA-256 of a Block
+        Creates a SHA-256 of a Block, or returns the hash a sealed block carries
         :param block: <dict> Block
         :return: <str>
         """
-        
-        # We must make sure that the dictionary is ordered, or we'll have inconsistent hashes
-        block_string = json.dumps(block, sort_keys=True).encode()
-        return hashlib.sha256(block_string).hexdigest()
+
+        if 'hash' in block:
+            return block['hash']
+        return Blockchain.compute_hash(block)
+
+    @staticmethod
+    def compute_hash(block):
+        """
+        Creates a SHA-256 of the canonical binary header of a Block, even if it carries a hash.
+        The header commits to the transactions through the Merkle root
+        :param block: <dict> Block
+        :return: <str>
+        """
+
+        return hashlib.sha256(encode_header(block)).hexdigest()
+
+    @staticmethod
+    def hash_transaction(transaction):
+        """
+        Creates a SHA-256 of the canonical binary form of a Transaction
+        :param transaction: <dict> Transaction
+        :return: <str>
+        """
+
+        return hashlib.sha256(encode_transaction(transaction)).hexdigest()
+
+    @staticmethod
+    def hash_transactions(transactions):
+        """
+        Hashes the Transactions of a block, across worker processes for large blocks
+        :param transactions: <list> Transactions
+        :return: <list> Their hashes, in the same order
+        """
+
+        if len(transactions) < PARALLEL_HASHING_THRESHOLD:
+            return [Blockchain.hash_transaction(transaction) for transaction in transactions]
+
+        pool = hashing_pool()
+        size = -(-len(transactions) // ((os.cpu_count() or 1) * 4))
+        chunks = [transactions[i:i + size] for i in range(0, len(transactions), size)]
+        return [h for hashes in pool.map(_hash_transactions, chunks) for h in hashes]
+
+    @staticmethod
+    def merkle_root(transaction_hashes):
+        """
+        The root of the Merkle Tree over the hashes of a block's Transactions
+        :param transaction_hashes: <list> Hashes of the Transactions
+        :return: <str>
+        """
+
+        # A block without transactions, like the genesis block, has the root of a single "0" leaf
+        return MerkleTree(transaction_hashes or ["0"]).getRootHash()
+
+    def merkle_proof(self, height, transaction_hash):
+        """
+        The Merkle branch of a transaction, which proves it is in a block without the block's other transactions
+        :param height: <int> Height of the block
+        :param transaction_hash: <str> Hash of the transaction
+        :return: <list> The branch, or None if the transaction is not in the block
+        """
+
+        if not 0 <= height < len(self.chain):
+            return None
+
+        transaction_hashes = self.chain[height]['transaction_hashes']
+        if transaction_hash not in transaction_hashes:
+            return None
+
+        return MerkleTree(transaction_hashes).getProof(transaction_hashes.index(transaction_hash))
+
+    def get_block(self, block_hash):
+        """
+        Look up a block of our chain by its hash
+        :param block_hash: <str> Hash of the block
+        :return: <dict> The block, or None if it is not in our chain
+        """
+
+        height = self.chain.height_of(block_hash)
+        return None if height is None else self.chain[height]
 
     @property
     def last_block(self):
         return self.chain[-1]
 
-    def proof_of_work(self, last_proof):
+    def proof_of_work(self, last_proof, workers=None):
         """
         Simple Proof of Work Algorithm:
         - Find a number p such that hash(p*p') contains 4 leading zeroes
         - p is the previous proof and p' is the new proof
+        The nonce space is split across a pool of worker processes, one per core
         :param last_proof: <int>
+        :param workers: (Optional) <int> Number of worker processes, defaults to the number of cores
         :return <int>
         """
 
-        proof = 0
-        while self.valid_proof(last_proof, proof) is False:
-            proof += 1
+        workers = workers or os.cpu_count() or 1
+        if workers == 1:
+            start = 0
+            while True:
+                proof = self.search_proofs(last_proof, start, start + 10000)
+                if proof is not None:
+                    return proof
+                start += 10000
 
-        return proof
+        return ProofSearch(last_proof, workers).start().wait()
+
+    @staticmethod
+    def search_proofs(last_proof, start, stop):
+        """
+        Searches a batch of nonces for a valid proof, accepting the same proofs as valid_proof.
+        The last_proof prefix is hashed once and its hash state copied for every nonce,
+        and the raw digest is compared against PROOF_TARGET
+        :param last_proof: <int> Previous Proof
+        :param start: <int> First nonce of the batch
+        :param stop: <int> Nonce after the last one of the batch
+        :return <int> The first valid proof in the batch, or None if there is none
+        """
+
+        copy_prefix = hashlib.sha256(f'{last_proof}'.encode()).copy
+        for proof in range(start, stop):
+            guess = copy_prefix()
+            guess.update(b'%d' % proof)
+            if guess.digest() < PROOF_TARGET:
+                return proof
+
+        return None
 
     @staticmethod
     def valid_proof(last_proof, proof):
@@ -143,34 +390,104 @@ class Blockchain(object):
         guess_hash = hashlib.sha256(guess).hexdigest()
         return guess_hash[:4] == "0000"
 
-    def valid_chain(self, chain):
+    def valid_chain(self, chain, height=0):
         """
-        Determine if a given blockchain is valid
-        :param chain: <list> A blockchain
+        Determine if a given blockchain is valid. The blocks it shares with our chain were
+        validated when they joined it, so only the blocks after the fork point are checked.
+        A shared block only has our header, its transactions are not checked, so the caller
+        must keep our copy of every block skipped rather than take the one in chain.
+        Every block checked is sealed with the hashes of its transactions, as computed here
+        :param chain: <list> A blockchain, or a run of blocks of one
+        :param height: <int> Height of the first block of chain
         :return: <bool> True if valid, False if not
         """
 
-        last_block = chain[0]
-        current_index = 1
+        skipped = self.fork_point(chain, height)
+        # The first block has nothing before it to be checked against, but its transactions are checked
+        if not skipped and chain and not self.valid_transactions(chain[0], height):
+            return False
+
+        current_index = max(skipped, 1)
+        if current_index >= len(chain):
+            return True
+
+        # The block before the first one checked has our header if any were skipped
+        last_block = chain[current_index - 1]
+        last_hash = self.compute_hash(last_block)
 
         while current_index < len(chain):
             block = chain[current_index]
-            print(f'{last_block}')
-            print(f'{block}')
-            print("\n-----------\n")
             # Check that the hash of the block is correct
-            if block['previous_hash'] != self.hash(last_block):
+            if block['previous_hash'] != last_hash:
+                logger.info('Invalid chain: wrong previous hash at height %d', height + current_index)
+                return False
+
+            # Check that the Merkle root commits to the transactions of the block
+            if not self.valid_transactions(block, height + current_index):
+                return False
+
+            # Check that the hash the block carries, if any, is its own
+            block_hash = self.compute_hash(block)
+            if block.get('hash', block_hash) != block_hash:
+                logger.info('Invalid chain: wrong block hash at height %d', height + current_index)
                 return False
 
             # Check that the Proof of Work is correct
             if not self.valid_proof(last_block['proof'], block['proof']):
+                logger.info('Invalid chain: wrong proof at height %d', height + current_index)
                 return False
 
             last_block = block
+            last_hash = block_hash
             current_index += 1
 
+        logger.info('Validated %d blocks, skipped %d shared with our chain', len(chain) - max(skipped, 1), skipped)
+        return True
+
+    def valid_transactions(self, block, height):
+        """
+        Determine if the Merkle root of a block commits to its transactions, and seal the block
+        with their hashes. Hashes the block brought with it are not trusted, they must be the same
+        :param block: <dict> Block
+        :param height: <int> Height of the block, for the log
+        :return: <bool> True if valid, False if not
+        """
+
+        if not isinstance(block['transactions'], list):
+            logger.info('Invalid chain: malformed transactions at height %d', height)
+            return False
+
+        transaction_hashes = self.hash_transactions(block['transactions'])
+        if block.get('transaction_hashes', transaction_hashes) != transaction_hashes:
+            logger.info('Invalid chain: wrong transaction hashes at height %d', height)
+            return False
+        if block['merkle_root'] != self.merkle_root(transaction_hashes):
+            logger.info('Invalid chain: wrong merkle root at height %d', height)
+            return False
+
+        block['transaction_hashes'] = transaction_hashes
         return True
 
+    def fork_point(self, chain, height=0):
+        """
+        Find where a chain stops sharing blocks with ours. Each block commits to the hash
+        of the one before it, so a chain that shares a block with ours shares every block
+        before it too, and the fork point can be found by binary search
+        :param chain: <list> A blockchain, or a run of blocks of one
+        :param height: <int> Height of the first block of chain, which is compared with ours at that height
+        :return: <int> Position in chain of its first block that is not in ours
+        """
+
+        low, high = 0, max(0, min(len(chain), len(self.chain) - height))
+        while low < high:
+            middle = (low + high + 1) // 2
+            # The hash a block carries is not trusted, it is computed from the header
+            if self.compute_hash(chain[middle - 1]) == self.chain.block_hash(height + middle - 1):
+                low = middle
+            else:
+                high = middle - 1
+        return low
+
     def resolve_conflicts(self):
         """
         This is our Consensus Algorithm, it resolves conflicts
@@ -178,118 +495,2221 @@ class Blockchain(object):
         :return: <bool> True if our chain was replaced, False if not
         """
 
-        neighbours = self.nodes
+        neighbours = list(self.nodes)
         new_chain = None
 
         # We're only looking for chains longer than ours
         max_length = len(self.chain)
 
-        # Grab and verify the chains from all the nodes in our network
-        for node in neighbours:
-            response = requests.get(f'http://{node}/chain')
-
-            if response.status_code == 200:
-                length = response.json()['length']
-                chain = response.json()['chain']
-
-                # Check if the length is longer and the chain is valid
-                if length > max_length and self.valid_chain(chain):
-                    max_length = length
-                    new_chain = chain
+        # Grab the blocks past the fork point from all the nodes in our network at once
+        # and verify them as they arrive, linked to the last block we share with each peer
+        node_of = {self.peer_executor.submit(self.fetch_suffix, node): node for node in neighbours}
+        for future in as_completed(node_of):
+            fetched = future.result()
+            if fetched is None:
+                continue
+            length, fork, blocks = fetched
+            if length <= max_length:
+                continue
+
+            # A block that is malformed, or cannot be encoded to be hashed, rejects only this peer
+            try:
+                # Keep our own copies of the blocks the peer sent that we already have, so that
+                # every block taken from the peer is one that valid_chain checks in full
+                shared = self.fork_point(blocks, fork)
+                fork, blocks = fork + shared, blocks[shared:]
+                anchor = self.chain[fork - 1:fork]
+                valid = self.valid_chain(anchor + blocks, fork - len(anchor))
+            except (KeyError, TypeError, ValueError) as error:
+                logger.info('Invalid chain from %s: %s', node_of[future], error)
+                continue
+
+            # Check if the length is longer and the chain is valid
+            if valid:
+                max_length = length
+                new_chain = (fork, blocks, anchor)
 
         # Replace our chain if we discovered a new, valid chain longer than ours
         if new_chain:
-            self.chain = new_chain
+            fork, blocks, anchor = new_chain
+            with self.lock:
+                # A block may have been mined, or the chain replaced, while the peers were being fetched
+                if fork + len(blocks) <= len(self.chain) or anchor and self.chain.block_hash(fork - 1) != self.hash(anchor[0]):
+                    return False
+                for block in blocks:
+                    # The blocks are sealed with the hashes of their headers, whatever the peer sent
+                    block['hash'] = self.compute_hash(block)
+
+                self.chain.truncate(fork)
+                self.chain.extend(blocks)
+                self.notify(fork, blocks)
             return True
 
         return False
 
-# Implementing the Merkle Root Tree
-class Node:
-    def __init__(self, left, right, value: str)-> None:
-        self.left: Node = left
-        self.right: Node = right
-        self.value = value
+    def fetch_suffix(self, node):
+        """
+        Fetch the blocks of a peer's chain after the last block it shares with ours.
+        The fork point is found by comparing header hashes, going twice as far back each round,
+        so only the headers and blocks past the fork point are downloaded
+        :param node: <str> Address of the peer. Eg. '192.168.0.5:5000'
+        :return: <tuple> The length of the peer's chain, the height of its first block that is not
+                 in ours and the blocks from there on, or None if the peer is not ahead or did not answer
+        """
 
-    @staticmethod
-    def hash(val: str)-> str:
-        return hashlib.sha256(val.encode('utf-8')).hexdigest()
+        chain = self.chain
+        window = 16
+        end = None
+        fork = None
+        while fork is None:
+            start = max(0, len(chain) - window)
+            fetched = self.fetch_range(node, start, end, headers=True)
+            if fetched is None:
+                return None
+            length, headers = fetched
+            if length <= len(chain):
+                return None
+
+            for offset in range(len(headers) - 1, -1, -1):
+                if self.chain.height_of(headers[offset].get('hash')) == start + offset:
+                    fork = start + offset + 1
+                    break
+            else:
+                if start == 0:
+                    fork = 0
+                end = start
+                window *= 2
+
+        fetched = self.fetch_range(node, fork)
+        if fetched is None:
+            return None
+        length, blocks = fetched
+        return length, fork, blocks
+
+    def fetch_range(self, node, start, end=None, headers=False):
+        """
+        Fetch a range of blocks, by height, from the chain of a peer
+        :param node: <str> Address of the peer. Eg. '192.168.0.5:5000'
+        :param start: <int> Height of the first block
+        :param end: (Optional) <int> Height after the last block, the tip of the chain if None
+        :param headers: <bool> Fetch only the headers of the blocks, with their hashes
+        :return: <tuple> The length of the peer's chain and the blocks, or None if it did not answer
+                 in time or its answer is malformed
+        """
 
-    @staticmethod
-    def doubleHash(val: str)-> str:
-        return Node.hash(Node.hash(val))
+        params = {'start': start}
+        if end is not None:
+            params['end'] = end
+        if headers:
+            params['headers'] = 1
+
+        # Blocks are transferred in their binary encoding, unless the peer only answers in JSON
+        try:
+            response = self.session.get(
+                f'http://{node}/chain', params=params, timeout=self.peer_timeout,
+                headers={'Accept': 'application/octet-stream'},
+            )
+        except requests.RequestException:
+            return None
+
+        if response.status_code != 200:
+            return None
+
+        if response.headers.get('Content-Type', '').startswith('application/octet-stream'):
+            try:
+                length = int(response.headers['X-Chain-Length'])
+                if headers:
+                    data = response.content
+                    chain = [decode_header(data, offset) for offset in range(0, len(data), BLOCK_HEADER.size)]
+                else:
+                    chain = decode_blocks(response.content)
+            except (KeyError, IndexError, ValueError, struct.error):
+                return None
+            return length, chain
+
+        try:
+            values = response.json()
+            length, chain = values['length'], values['chain']
+        except (KeyError, TypeError, ValueError):
+            return None
+        if not isinstance(length, int) or not isinstance(chain, list) or not all(isinstance(block, dict) for block in chain):
+            return None
+        return length, chain
+
+    def headers(self, start=0, end=None):
+        """
+        The headers of a range of blocks: every field but the transactions and their hashes
+        :param start: <int> Height of the first block
+        :param end: (Optional) <int> Height after the last block, the tip of the chain if None
+        :return: <list> Headers
+        """
+
+        return self.chain.headers(start, end)
+
+# Encoding blocks and transactions
+# Every block and transaction has a single canonical binary form, which is what is hashed,
+# stored in the block log and sent to peers. It starts with a version byte, integers have a
+# fixed width and hashes are 32 raw bytes. JSON is only a representation for the API.
+# Decoding accepts nothing but the canonical form, and raises ValueError for anything else
+
+CODEC_VERSION = 1
+
+# Version, index, timestamp, proof, previous hash and Merkle root
+BLOCK_HEADER = struct.Struct('>BQdQ32s32s')
+OUTPOINT = struct.Struct('>32sI')
+INT64 = struct.Struct('>q')
+FLOAT64 = struct.Struct('>d')
+
+# The fields a transaction may have, encoded in this order, each after its position as a tag byte
+TRANSACTION_FIELDS = ('sender', 'recipient', 'amount', 'fee', 'block', 'input_transactions', 'output_transactions', 'nonce')
+NONCE = struct.Struct('>Q')
+
+def is_amount(value)-> bool:
+    # Amounts are encoded as 64 bit integers or finite doubles
+    if isinstance(value, bool):
+        return False
+    return isinstance(value, float) and math.isfinite(value) or isinstance(value, int) and -2 ** 63 <= value < 2 ** 63
+
+def is_nonce(value)-> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and 0 <= value < 2 ** 64
+
+def write_varint(out: bytearray, value: int)-> None:
+    if value < 0:
+        raise ValueError(f'Cannot encode {value} as an unsigned integer')
+    while value >= 0x80:
+        out.append(value & 0x7f | 0x80)
+        value >>= 7
+    out.append(value)
+
+def check_length(data: bytes, position: int, size: int)-> None:
+    # Raise ValueError if data ends before the size bytes from position
+    if position + size > len(data):
+        raise ValueError(f'Truncated encoding: {size} bytes needed at {position}, {len(data)} in all')
+
+def read_varint(data: bytes, position: int)-> Tuple[int, int]:
+    value = shift = 0
+    while True:
+        check_length(data, position, 1)
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if byte < 0x80:
+            # A final zero byte after the first would be a longer encoding of the same value
+            if byte == 0 and shift:
+                raise ValueError('Non-canonical varint')
+            return value, position
+        shift += 7
+        if shift > 63:
+            raise ValueError('Varint longer than 64 bits')
+
+def write_string(out: bytearray, value: str)-> None:
+    if not isinstance(value, str):
+        raise ValueError(f'Expected a string, not {value!r}')
+    raw = value.encode()
+    write_varint(out, len(raw))
+    out += raw
+
+def read_string(data: bytes, position: int)-> Tuple[str, int]:
+    length, position = read_varint(data, position)
+    check_length(data, position, length)
+    return bytes(data[position:position + length]).decode(), position + length
+
+def write_amount(out: bytearray, value)-> None:
+    if not is_amount(value):
+        raise ValueError(f'Expected an amount, not {value!r}')
+    if isinstance(value, int):
+        out.append(0)
+        out += INT64.pack(value)
+    else:
+        out.append(1)
+        out += FLOAT64.pack(value)
+
+def read_amount(data: bytes, position: int)-> Tuple[float, int]:
+    check_length(data, position, 1)
+    if data[position] not in (0, 1):
+        raise ValueError(f'Unknown amount encoding {data[position]}')
+    codec = INT64 if data[position] == 0 else FLOAT64
+    check_length(data, position + 1, codec.size)
+    value = codec.unpack_from(data, position + 1)[0]
+    if not is_amount(value):
+        raise ValueError(f'Expected an amount, not {value!r}')
+    return value, position + 1 + codec.size
+
+def hash_bytes(value)-> bytes:
+    # The genesis block names its previous hash as the number 1
+    if isinstance(value, int):
+        return value.to_bytes(32, 'big')
+    raw = bytes.fromhex(value)
+    if len(raw) != 32:
+        raise ValueError(f'Expected a 32 byte hash, not {value!r}')
+    return raw
+
+def encode_transaction(transaction: dict)-> bytes:
+    """
+    The canonical binary form of a Transaction
+    :param transaction: <dict> Transaction
+    :return: <bytes>
+    """
+
+    if not isinstance(transaction, dict):
+        raise ValueError(f'Expected a transaction, not {transaction!r}')
+    unknown = transaction.keys() - set(TRANSACTION_FIELDS)
+    if unknown:
+        raise ValueError(f'Cannot encode transaction fields {sorted(unknown)}')
+
+    out = bytearray((CODEC_VERSION,))
+    try:
+        for tag, field in enumerate(TRANSACTION_FIELDS):
+            if field not in transaction:
+                continue
+            value = transaction[field]
+            out.append(tag)
+            if field in ('sender', 'recipient'):
+                write_string(out, value)
+            elif field in ('amount', 'fee'):
+                write_amount(out, value)
+            elif field == 'block':
+                write_varint(out, value)
+            elif field == 'input_transactions':
+                write_varint(out, len(value))
+                for spend in value:
+                    if spend.keys() != {'transaction_hash', 'index'}:
+                        raise ValueError(f'Expected the transaction_hash and index of an output, not {spend!r}')
+                    out += OUTPOINT.pack(hash_bytes(spend['transaction_hash']), spend['index'])
+            elif field == 'nonce':
+                out += NONCE.pack(value)
+            else:
+                write_varint(out, len(value))
+                for output in value:
+                    if output.keys() != {'recipient', 'amount'}:
+                        raise ValueError(f'Expected the recipient and amount of an output, not {output!r}')
+                    write_string(out, output['recipient'])
+                    write_amount(out, output['amount'])
+    except (AttributeError, TypeError, struct.error) as error:
+        raise ValueError(f'Cannot encode transaction: {error}')
+    return bytes(out)
+
+def decode_transaction(data: bytes)-> dict:
+    """
+    A Transaction from its canonical binary form. Fields out of order or repeated, and encodings
+    that are truncated or longer than they need be, are rejected with ValueError
+    :param data: <bytes>
+    :return: <dict> Transaction
+    """
+
+    check_length(data, 0, 1)
+    if data[0] != CODEC_VERSION:
+        raise ValueError(f'Unknown transaction encoding version {data[0]}')
+
+    transaction = {}
+    position = 1
+    last_tag = -1
+    while position < len(data):
+        tag = data[position]
+        if not last_tag < tag < len(TRANSACTION_FIELDS):
+            raise ValueError(f'Unexpected transaction field tag {tag} after {last_tag}')
+        last_tag = tag
+        field = TRANSACTION_FIELDS[tag]
+        position += 1
+        if field in ('sender', 'recipient'):
+            transaction[field], position = read_string(data, position)
+        elif field in ('amount', 'fee'):
+            transaction[field], position = read_amount(data, position)
+        elif field == 'block':
+            transaction[field], position = read_varint(data, position)
+        elif field == 'input_transactions':
+            count, position = read_varint(data, position)
+            spends = []
+            for _ in range(count):
+                check_length(data, position, OUTPOINT.size)
+                transaction_hash, index = OUTPOINT.unpack_from(data, position)
+                position += OUTPOINT.size
+                spends.append({'transaction_hash': transaction_hash.hex(), 'index': index})
+            transaction[field] = spends
+        elif field == 'nonce':
+            check_length(data, position, NONCE.size)
+            transaction[field] = NONCE.unpack_from(data, position)[0]
+            position += NONCE.size
+        else:
+            count, position = read_varint(data, position)
+            outputs = []
+            for _ in range(count):
+                recipient, position = read_string(data, position)
+                amount, position = read_amount(data, position)
+                outputs.append({'recipient': recipient, 'amount': amount})
+            transaction[field] = outputs
+    return transaction
+
+def encode_header(block: dict)-> bytes:
+    """
+    The canonical binary header of a Block, whose SHA-256 is the hash of the block
+    :param block: <dict> Block
+    :return: <bytes>
+    """
+
+    try:
+        return BLOCK_HEADER.pack(
+            CODEC_VERSION, block['index'], block['timestamp'], block['proof'],
+            hash_bytes(block['previous_hash']), hash_bytes(block['merkle_root']),
+        )
+    except (TypeError, struct.error) as error:
+        raise ValueError(f'Cannot encode block header: {error}')
+
+def decode_header(data: bytes, offset: int = 0)-> dict:
+    """
+    A Block header, with the hash of the block, from its canonical binary form
+    :param data: <bytes>
+    :param offset: <int> Where the header starts in data
+    :return: <dict> Header
+    """
+
+    check_length(data, offset, BLOCK_HEADER.size)
+    version, index, timestamp, proof, previous_hash, merkle_root = BLOCK_HEADER.unpack_from(data, offset)
+    if version != CODEC_VERSION:
+        raise ValueError(f'Unknown block encoding version {version}')
+    return {
+        'index': index,
+        'timestamp': timestamp,
+        'proof': proof,
+        'previous_hash': previous_hash.hex(),
+        'merkle_root': merkle_root.hex(),
+        'hash': hashlib.sha256(data[offset:offset + BLOCK_HEADER.size]).hexdigest(),
+    }
+
+def encode_block(block: dict)-> bytes:
+    """
+    The canonical binary form of a Block: its header, then each transaction after its length
+    :param block: <dict> Block
+    :return: <bytes>
+    """
+
+    out = bytearray(encode_header(block))
+    write_varint(out, len(block['transactions']))
+    for transaction in block['transactions']:
+        encoded = encode_transaction(transaction)
+        write_varint(out, len(encoded))
+        out += encoded
+    return bytes(out)
+
+def decode_block(data: bytes)-> dict:
+    """
+    A Block, sealed with its hash and the hashes of its transactions, from its canonical binary form
+    :param data: <bytes>
+    :return: <dict> Block
+    """
+
+    block = decode_header(data)
+    count, position = read_varint(data, BLOCK_HEADER.size)
+    transactions = []
+    transaction_hashes = []
+    for _ in range(count):
+        length, position = read_varint(data, position)
+        check_length(data, position, length)
+        encoded = data[position:position + length]
+        position += length
+        # Only the canonical encoding of a transaction decodes, so the bytes received are the ones its hash is of
+        transactions.append(decode_transaction(encoded))
+        transaction_hashes.append(hashlib.sha256(encoded).hexdigest())
+    if position != len(data):
+        raise ValueError(f'{len(data) - position} bytes after the transactions of the block')
+
+    block['transactions'] = transactions
+    block['transaction_hashes'] = transaction_hashes
+    return block
+
+def encode_blocks(blocks: List[dict])-> bytes:
+    # A run of blocks, each after its length
+    out = bytearray()
+    for block in blocks:
+        encoded = encode_block(block)
+        write_varint(out, len(encoded))
+        out += encoded
+    return bytes(out)
+
+def decode_blocks(data: bytes)-> List[dict]:
+    blocks = []
+    position = 0
+    while position < len(data):
+        length, position = read_varint(data, position)
+        check_length(data, position, length)
+        blocks.append(decode_block(data[position:position + length]))
+        position += length
+    return blocks
+
+# Implementing the Merkle Root Tree
+def doubleHash(data: bytes)-> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
 
 class MerkleTree:
+    """
+    Merkle Tree built level by level, without recursion. Each level is a contiguous
+    buffer of 32 byte digests, from the leaves up to the root, and the last node of
+    an odd level is paired with itself
+    """
+
     def __init__(self, values: List[str])-> None:
+        if not values:
+            raise ValueError("A Merkle Tree needs at least one value")
         self.__buildTree(values)
 
     def __buildTree(self, values: List[str])-> None:
-        leaves: List[Node] = [Node(None, None, Node.doubleHash(e)) for e in values]
-        if len(leaves) % 2 == 1:
-            leaves.append(leaves[-1:][0]) # duplicate last elem if odd number of elements
-        self.root: Node = self.__buildTreeRec(leaves)
+        level = bytearray(32 * len(values))
+        for i, e in enumerate(values):
+            level[32 * i:32 * i + 32] = doubleHash(e.encode('utf-8'))
+        self.levels: List[bytearray] = [level]
+
+        while len(level) > 32 or len(self.levels) == 1:
+            nodes = memoryview(level)
+            if len(level) % 64:
+                nodes = memoryview(level + level[-32:]) # duplicate last elem if odd number of elements
+            level = bytearray(len(nodes) // 2)
+            for i in range(0, len(nodes), 64):
+                level[i // 2:i // 2 + 32] = doubleHash(nodes[i:i + 64])
+            self.levels.append(level)
+
+    def printTree(self)-> None:
+        for level in reversed(self.levels):
+            for i in range(0, len(level), 32):
+                print(level[i:i + 32].hex())
+
+    def getRootHash(self)-> str:
+        return self.levels[-1].hex()
 
-    def __buildTreeRec(self, nodes: List[Node])-> Node:
-        half: int = len(nodes) // 2
+    def getProof(self, index: int)-> List[dict]:
+        """
+        The Merkle branch of a leaf: the sibling of each node on its path to the root
+        :param index: <int> Position of the leaf
+        :return: <list> The siblings, from the leaves up, with the side they are on
+        """
 
-        if len(nodes) == 2:
-            return Node(nodes[0], nodes[1], Node.doubleHash(nodes[0].value + nodes[1].value))
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if 32 * sibling >= len(level):
+                sibling = index # the last elem of an odd level is paired with itself
+            proof.append({
+                'hash': level[32 * sibling:32 * sibling + 32].hex(),
+                'position': 'left' if sibling < index else 'right',
+            })
+            index //= 2
+        return proof
 
-        left: Node = self.__buildTreeRec(nodes[:half])
-        right: Node = self.__buildTreeRec(nodes[half:])
-        value: str = Node.doubleHash(left.value + right.value)
-        return Node(left, right, value)
+# Signature schemes for wallets. A signed transaction names its scheme, RSA if it does not
+class RSAScheme:
+    """
+    1024 bit RSA with PKCS#1 v1.5 signatures over SHA-1, kept for compatibility with older wallets
+    """
 
-    def printTree(self)-> None:
-        self.__printTreeRec(self.root)
+    name = 'rsa'
+
+    @staticmethod
+    def generate():
+        return RSA.generate(1024, Crypto.Random.new().read)
+
+    @staticmethod
+    def export_public_key(private_key)-> bytes:
+        return private_key.publickey().exportKey(format='DER')
+
+    @staticmethod
+    def sign(private_key, message: bytes)-> bytes:
+        return PKCS1_v1_5.new(private_key).sign(SHA.new(message))
+
+    @staticmethod
+    def verifier(public_key: bytes):
+        # A function checking signatures of messages against the public key, ValueError if the key is malformed
+        verifier = PKCS1_v1_5.new(RSA.importKey(public_key))
+        return lambda message, signature: verifier.verify(SHA.new(message), signature)
+
+class Ed25519Scheme:
+    """
+    Ed25519 signatures: keys are quick to generate, and signatures are smaller and faster to verify than RSA's
+    """
+
+    name = 'ed25519'
+
+    @staticmethod
+    def generate():
+        return ECC.generate(curve='ed25519')
+
+    @staticmethod
+    def export_public_key(private_key)-> bytes:
+        return private_key.public_key().export_key(format='DER')
+
+    @staticmethod
+    def sign(private_key, message: bytes)-> bytes:
+        return eddsa.new(private_key, 'rfc8032').sign(message)
+
+    @staticmethod
+    def verifier(public_key: bytes):
+        # A function checking signatures of messages against the public key, ValueError if the key is malformed
+        verifier = eddsa.new(ECC.import_key(public_key), 'rfc8032')
+
+        def verify(message, signature):
+            try:
+                verifier.verify(message, signature)
+            except ValueError:
+                return False
+            return True
+
+        return verify
+
+SIGNATURE_SCHEMES = {scheme.name: scheme for scheme in (RSAScheme, Ed25519Scheme)}
+
+# The mempool holds transactions up to this many bytes, counting each as its encoded size
+# plus MEMPOOL_ENTRY_OVERHEAD for the objects that hold it in memory
+MEMPOOL_SIZE = 64 * 1024 * 1024
+MEMPOOL_ENTRY_OVERHEAD = 512
+
+# Orders in which the mempool's transactions can be taken into a block
+BLOCK_ORDERS = ('arrival', 'fee')
+
+class Mempool:
+    """
+    Transactions waiting to be mined, indexed by their hash so duplicates are rejected in O(1).
+    It holds at most max_size bytes of transactions, by their encoded size, so that a flood of
+    large transactions takes no more memory than one of small ones: once full, a transaction
+    paying a higher fee evicts those paying the lowest fees, oldest first, until it fits, and
+    any other transaction is rejected. A pinned transaction, the reward of the next block, is
+    held over the budget and never evicted. The outputs spent by the transactions are indexed
+    too, so that no two of them spend the same one
+    """
+
+    def __init__(self, max_size: int = MEMPOOL_SIZE)-> None:
+        self.max_size = max_size
+        # bytes taken by the transactions that are not pinned
+        self.size = 0
+        # hash -> (fee, arrival, transaction, size), in arrival order
+        self.entries: typing.OrderedDict[str, tuple] = collections.OrderedDict()
+        # heap of (fee, arrival, hash), which keeps the entries of removed transactions until it is compacted
+        self.fees: List[tuple] = []
+        # hashes of the pinned transactions, which are kept out of the heap
+        self.pinned: Set[str] = set()
+        # (transaction hash, index) of each output spent -> hash of the transaction spending it
+        self.spends: Dict[Tuple[str, int], str] = {}
+        self.arrivals = 0
+        # Merkle Tree over the hashes in arrival order, None once a removal has made it stale
+        self.tree: Optional[MerkleAccumulator] = MerkleAccumulator()
+
+    def __len__(self)-> int:
+        return len(self.entries)
+
+    def __contains__(self, transaction_hash: str)-> bool:
+        return transaction_hash in self.entries
+
+    def add(self, transaction_hash: str, transaction: dict, fee: int = 0, size: Optional[int] = None, pinned: bool = False)-> bool:
+        """
+        Add a transaction to the pool
+        :param size: (Optional) <int> Length of the encoding of the transaction, encoded here if not given
+        :param pinned: <bool> Hold the transaction even when the pool is full, and never evict it
+        :return: <bool> True if it was added, False if it is a duplicate, spends an output another transaction
+                 of the pool spends, or its fee is too low for it to fit in a full pool
+        """
+
+        if transaction_hash in self.entries:
+            return False
+
+        spent = [(spend['transaction_hash'], spend['index']) for spend in transaction.get('input_transactions') or []]
+        if any(key in self.spends for key in spent):
+            return False
+
+        if size is None:
+            size = len(encode_transaction(transaction))
+        size += MEMPOOL_ENTRY_OVERHEAD
+        if not pinned and size > self.max_size:
+            return False
+
+        if not pinned and self.size + size > self.max_size:
+            # Take the lowest fees off the heap until the transaction fits, and put them back if it never does
+            evicted = []
+            freed = 0
+            while self.size - freed + size > self.max_size:
+                lowest = self.lowest()
+                if lowest is None or fee <= self.entries[lowest][0]:
+                    for item in evicted:
+                        heapq.heappush(self.fees, item)
+                    return False
+                evicted.append(heapq.heappop(self.fees))
+                freed += self.entries[lowest][3]
+            self.remove([transaction_hash for _, _, transaction_hash in evicted])
+
+        self.arrivals += 1
+        self.entries[transaction_hash] = (fee, self.arrivals, transaction, size)
+        for key in spent:
+            self.spends[key] = transaction_hash
+        if pinned:
+            self.pinned.add(transaction_hash)
+        else:
+            self.size += size
+            heapq.heappush(self.fees, (fee, self.arrivals, transaction_hash))
+        if self.tree is not None:
+            self.tree.append(transaction_hash)
+        return True
+
+    def lowest(self)-> Optional[str]:
+        # The hash of the transaction paying the lowest fee, dropping stale heap entries on the way
+        while self.fees:
+            fee, arrival, transaction_hash = self.fees[0]
+            entry = self.entries.get(transaction_hash)
+            if entry is not None and entry[1] == arrival:
+                return transaction_hash
+            heapq.heappop(self.fees)
+        return None
+
+    def remove(self, transaction_hashes: List[str])-> None:
+        for transaction_hash in transaction_hashes:
+            entry = self.entries.pop(transaction_hash, None)
+            if entry is None:
+                continue
+            if transaction_hash in self.pinned:
+                self.pinned.discard(transaction_hash)
+            else:
+                self.size -= entry[3]
+            for spend in entry[2].get('input_transactions') or []:
+                self.spends.pop((spend['transaction_hash'], spend['index']), None)
+        self.tree = None
+
+        if len(self.fees) > 2 * len(self.entries):
+            self.fees = [(fee, arrival, h) for h, (fee, arrival, _, _) in self.entries.items() if h not in self.pinned]
+            heapq.heapify(self.fees)
+
+    def clear(self)-> None:
+        self.size = 0
+        self.entries = collections.OrderedDict()
+        self.fees = []
+        self.pinned = set()
+        self.spends = {}
+        self.tree = MerkleAccumulator()
+
+    def template(self, order: str = 'arrival')-> tuple:
+        """
+        The pending transactions for a block template
+        :param order: <str> 'arrival' for first come first served, 'fee' for the highest fees first
+        :return: <tuple> The hashes of the transactions and the transactions, in the same order
+        """
+
+        items = self.entries.items()
+        if order == 'fee':
+            items = sorted(items, key=lambda item: (-item[1][0], item[1][1]))
 
-    def __printTreeRec(self, node)-> None:
-        if node != None:
-            print(node.value)
-            self.__printTreeRec(node.left)
-            self.__printTreeRec(node.right)
+        transaction_hashes = [transaction_hash for transaction_hash, _ in items]
+        transactions = [entry[2] for _, entry in items]
+        return transaction_hashes, transactions
+
+    def stats(self)-> dict:
+        return {
+            'transactions': len(self.entries),
+            'size': self.size,
+            'max_size': self.max_size,
+        }
+
+    def merkle_root(self)-> str:
+        # The root over the pending transactions in arrival order, rebuilt only after a removal
+        if self.tree is None:
+            self.tree = MerkleAccumulator()
+            for transaction_hash in self.entries:
+                self.tree.append(transaction_hash)
+        return self.tree.getRootHash()
+
+class MerkleAccumulator:
+    """
+    Append-only Merkle Tree that keeps only the unpaired node of each level. A value is added
+    in O(log n) and the root, the same as MerkleTree's over the same values, is found in O(log n)
+    """
+
+    def __init__(self)-> None:
+        self.pending: List[Optional[bytes]] = []
+        self.count = 0
+
+    def append(self, value: str)-> None:
+        node = doubleHash(value.encode('utf-8'))
+        height = 0
+        while height < len(self.pending) and self.pending[height] is not None:
+            node = doubleHash(self.pending[height] + node)
+            self.pending[height] = None
+            height += 1
+
+        if height == len(self.pending):
+            self.pending.append(node)
+        else:
+            self.pending[height] = node
+        self.count += 1
 
     def getRootHash(self)-> str:
-        return self.root.value
-    
+        if not self.count:
+            raise ValueError("A Merkle Tree needs at least one value")
+
+        # Fold the unpaired nodes from the leaves up, pairing the last node of an odd level with itself
+        node = None
+        for height, left in enumerate(self.pending):
+            top = height == len(self.pending) - 1
+            if left is not None and node is not None:
+                node = doubleHash(left + node)
+            elif left is not None:
+                # A lone node at the top is the root, unless it is a single leaf
+                node = left if top and height > 0 else doubleHash(left + left)
+            elif node is not None:
+                node = doubleHash(node + node)
+        return node.hex()
+
+# Hashing the transactions of large blocks in parallel
+_hashing_pool = None
+_hashing_pool_lock = threading.Lock()
+
+def hashing_pool()-> ProcessPoolExecutor:
+    # The pool is started on first use and shared by every large block
+    global _hashing_pool
+    with _hashing_pool_lock:
+        if _hashing_pool is None:
+            _hashing_pool = ProcessPoolExecutor()
+        return _hashing_pool
+
+def _hash_transactions(transactions)-> List[str]:
+    return [Blockchain.hash_transaction(transaction) for transaction in transactions]
+
+# Implementing the parallel Proof of Work search
+def _search_proofs(last_proof, cursor, chunk_size, stop, results)-> None:
+    # Claim the next chunk of nonces until some worker has found a proof
+    while not stop.is_set():
+        with cursor.get_lock():
+            start = cursor.value
+            cursor.value += chunk_size
+
+        proof = Blockchain.search_proofs(last_proof, start, start + chunk_size)
+        if proof is not None:
+            results.put(proof)
+            stop.set()
+            return
+
+class ProofSearch:
+    """
+    Searches for a proof across a pool of worker processes. Workers claim chunks
+    of nonces from a shared cursor and all of them stop as soon as one finds a proof
+    """
+
+    def __init__(self, last_proof: int, workers: int, chunk_size: int = 10000)-> None:
+        self.last_proof = last_proof
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.cursor = multiprocessing.Value('q', 0)
+        self.stop = multiprocessing.Event()
+        self.results = multiprocessing.Queue()
+        self.processes: List[multiprocessing.Process] = []
+
+    def start(self)-> 'ProofSearch':
+        for _ in range(self.workers):
+            process = multiprocessing.Process(
+                target=_search_proofs,
+                args=(self.last_proof, self.cursor, self.chunk_size, self.stop, self.results),
+                daemon=True,
+            )
+            process.start()
+            self.processes.append(process)
+        return self
+
+    def wait(self, timeout: Optional[float] = None)-> Optional[int]:
+        """
+        Wait for a worker to find a proof
+        :param timeout: (Optional) <float> Seconds to wait, forever if None
+        :return: <int> The proof found, or None if the timeout expired first
+        """
+
+        try:
+            proof = self.results.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        self.cancel()
+        return proof
+
+    def cancel(self)-> None:
+        self.stop.set()
+        for process in self.processes:
+            process.join()
+
+    @property
+    def hashes(self)-> int:
+        # Nonces claimed by the workers so far
+        return self.cursor.value
+
+class MiningWorker:
+    """
+    Mines blocks in the background of the HTTP server. The proof of work runs in a ProofSearch
+    and a monitor thread forges the block once a proof is found. The job is cancelled, and
+    restarted on the new tip, whenever the tip of the chain changes under it
+    """
+
+    def __init__(self, blockchain: Blockchain, recipient: str, workers: Optional[int] = None)-> None:
+        self.blockchain = blockchain
+        self.recipient = recipient
+        self.workers = workers or os.cpu_count() or 1
+        self.lock = threading.Lock()
+        self.thread: Optional[threading.Thread] = None
+        self.running = False
+        self.continuous = False
+        self.jobs = 0
+        self.blocks_mined = 0
+        self.search: Optional[ProofSearch] = None
+        self.cancelled = threading.Event()
+        self.template = None
+        self.started = None
+        blockchain.subscribe(self.on_tip_change)
+
+    def start(self, continuous: bool = False)-> bool:
+        """
+        Start mining on the current tip of the chain
+        :param continuous: <bool> Keep mining block after block until stopped
+        :return: <bool> True if mining was started, False if it was already running
+        """
+
+        with self.lock:
+            if self.running:
+                self.continuous = self.continuous or continuous
+                return False
+
+            self.running = True
+            self.continuous = continuous
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+            return True
+
+    def stop(self)-> bool:
+        with self.lock:
+            was_running = self.running
+            self.running = False
+            self.cancel()
+        return was_running
+
+    def cancel(self)-> None:
+        # Abandon the current job; the caller holds self.lock
+        self.cancelled.set()
+        if self.search is not None:
+            self.search.stop.set()
+
+    def on_tip_change(self, fork, blocks)-> None:
+        with self.lock:
+            if self.template is not None and self.template is not self.blockchain.last_block:
+                self.cancel()
+
+    def run(self)-> None:
+        while True:
+            template = self.blockchain.last_block
+            search = ProofSearch(template['proof'], self.workers)
+            with self.lock:
+                # A stopped worker may have been restarted on a new thread
+                if not self.running or self.thread is not threading.current_thread():
+                    break
+                self.jobs += 1
+                self.search = search
+                self.template = template
+                self.started = time()
+                self.cancelled.clear()
+
+            search.start()
+            proof = None
+            while proof is None and not self.cancelled.is_set():
+                proof = search.wait(timeout=0.5)
+            search.cancel()
+
+            with self.lock:
+                self.search = None
+                self.template = None
+
+            if proof is not None and self.forge(template, proof):
+                with self.lock:
+                    self.blocks_mined += 1
+                    if not self.continuous:
+                        self.running = False
+
+        with self.lock:
+            if self.thread is threading.current_thread():
+                self.thread = None
+
+    def forge(self, template, proof)-> bool:
+        with self.blockchain.lock:
+            # The tip may have changed while the proof was being searched for
+            if self.blockchain.last_block is not template:
+                return False
+
+            # We must receive a reward for finding the proof.
+            self.blockchain.new_reward(self.recipient, 1)
+
+            # Forge the new Block by adding it to the chain
+            previous_hash = self.blockchain.hash(template)
+            self.blockchain.new_block(proof, previous_hash)
+            return True
+
+    def status(self)-> dict:
+        with self.lock:
+            status = {
+                'mining': self.running,
+                'continuous': self.continuous,
+                'jobs': self.jobs,
+                'blocks_mined': self.blocks_mined,
+                'template': None,
+            }
+            if self.search is not None:
+                elapsed = time() - self.started
+                status['template'] = {
+                    'index': self.template['index'] + 1,
+                    'last_proof': self.template['proof'],
+                    'previous_hash': self.blockchain.hash(self.template),
+                }
+                status['elapsed'] = elapsed
+                status['hashes'] = self.search.hashes
+                status['hashrate'] = self.search.hashes / elapsed if elapsed else 0
+            return status
+
+# Storing the chain on disk
+class BlockLog:
+    """
+    Append-only log of the blocks of the chain. Each record is the length and CRC-32 of the
+    block's binary encoding followed by the encoding itself, and a separate index file holds
+    the offset of each record. Appends are made durable by a group commit: one fsync covers every block
+    appended within commit_interval seconds, or commit_size blocks, whichever comes first.
+    On startup the index is memory-mapped and only its last record is checked, and a torn
+    tail left by a crash is cut off
+    """
+
+    RECORD = struct.Struct('<II')
+
+    def __init__(self, path: str, commit_interval: float = 0.05, commit_size: int = 256)-> None:
+        self.path = path
+        self.commit_interval = commit_interval
+        self.commit_size = commit_size
+        self.lock = threading.Lock()
+        self.pending = 0
+        self.closed = threading.Event()
+
+        self.log = open(path, 'a+b')
+        self.index = open(path + '.idx', 'a+b')
+        self.offsets = self.recover()
+        self.end = self.log.seek(0, os.SEEK_END)
+
+        self.flusher = threading.Thread(target=self.flush_periodically, daemon=True)
+        self.flusher.start()
+        atexit.register(self.close)
+
+    def __len__(self)-> int:
+        return len(self.offsets)
+
+    def __iter__(self):
+        return self.blocks()
+
+    def blocks(self, start: int = 0, end: Optional[int] = None):
+        # Read a range of blocks in order, in one sequential pass over the memory-mapped log
+        offsets = self.offsets[start:end]
+        if not offsets:
+            return
+        with self.lock:
+            self.log.flush()
+        with open(self.path, 'rb') as log, mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            unpack_from = self.RECORD.unpack_from
+            for offset in offsets:
+                length, _ = unpack_from(data, offset)
+                start = offset + self.RECORD.size
+                yield decode_block(data[start:start + length])
+
+    def headers(self):
+        # Read only the header of each block, in one sequential pass over the memory-mapped log
+        if not self.offsets:
+            return
+        with self.lock:
+            self.log.flush()
+        with open(self.path, 'rb') as log, mmap.mmap(log.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            for offset in self.offsets:
+                yield decode_header(data, offset + self.RECORD.size)
+
+    def read(self, height: int)-> dict:
+        with self.lock:
+            self.log.flush()
+        with open(self.path, 'rb') as log:
+            log.seek(self.offsets[height])
+            return decode_block(self.read_record(log))
+
+    def read_record(self, log)-> Optional[bytes]:
+        # The payload of the record at the current position, None if it is torn or corrupt
+        header = log.read(self.RECORD.size)
+        if len(header) < self.RECORD.size:
+            return None
+        length, checksum = self.RECORD.unpack(header)
+        payload = log.read(length)
+        if len(payload) < length or zlib.crc32(payload) != checksum:
+            return None
+        return payload
+
+    def recover(self)-> array:
+        offsets = array('Q')
+        index_size = self.index.seek(0, os.SEEK_END)
+        if index_size >= 8:
+            with mmap.mmap(self.index.fileno(), index_size - index_size % 8, access=mmap.ACCESS_READ) as index:
+                offsets.frombytes(index)
+
+        with open(self.path, 'rb') as log:
+            # Drop index entries of records that did not make it to disk whole
+            end = 0
+            while offsets:
+                log.seek(offsets[-1])
+                if self.read_record(log) is not None:
+                    end = log.tell()
+                    break
+                offsets.pop()
+
+            # Index records that made it to disk after the last indexed one
+            log.seek(end)
+            while self.read_record(log) is not None:
+                offsets.append(end)
+                end = log.tell()
+
+        if self.log.seek(0, os.SEEK_END) != end or index_size != 8 * len(offsets):
+            self.log.truncate(end)
+            self.index.truncate(0)
+            self.index.write(offsets.tobytes())
+            self.sync()
+        return offsets
+
+    def append(self, blocks: List[dict])-> None:
+        with self.lock:
+            new_offsets = array('Q')
+            for block in blocks:
+                payload = encode_block(block)
+                self.log.write(self.RECORD.pack(len(payload), zlib.crc32(payload)))
+                self.log.write(payload)
+                new_offsets.append(self.end)
+                self.end += self.RECORD.size + len(payload)
+
+            self.offsets.extend(new_offsets)
+            self.index.write(new_offsets.tobytes())
+            self.pending += len(blocks)
+            if self.pending >= self.commit_size:
+                self.commit()
+
+    def truncate(self, height: int)-> None:
+        # Drop the blocks from height onwards
+        with self.lock:
+            if height >= len(self.offsets):
+                return
+            self.end = self.offsets[height]
+            del self.offsets[height:]
+            self.log.flush()
+            self.log.truncate(self.end)
+            self.index.flush()
+            self.index.truncate(8 * height)
+            self.commit()
+
+    def commit(self)-> None:
+        # The caller holds self.lock
+        self.sync()
+        self.pending = 0
+
+    def sync(self)-> None:
+        self.log.flush()
+        os.fsync(self.log.fileno())
+        self.index.flush()
+        os.fsync(self.index.fileno())
+
+    def flush_periodically(self)-> None:
+        while not self.closed.wait(self.commit_interval):
+            with self.lock:
+                if self.pending and not self.closed.is_set():
+                    self.commit()
+
+    def close(self)-> None:
+        with self.lock:
+            if self.closed.is_set():
+                return
+            self.commit()
+            self.closed.set()
+            self.log.close()
+            self.index.close()
+
+# Holding the chain in memory
+
+# Besides the tip, the blocks read last are kept whole, up to this many
+BLOCK_CACHE_SIZE = 256
+
+# Iterating over the chain reads this many blocks at a time from the log
+CHAIN_READ_SIZE = 1000
+
+class ColumnarChain:
+    """
+    The chain as a sequence of blocks whose header fields are held in contiguous typed
+    columns, about 120 bytes a block, while the transactions are kept apart and only read
+    when a block is asked for. With a block log, which is written here as blocks are added
+    and truncated, the transactions are read back from it; without one, each block keeps its
+    binary encoding. The tip is kept whole, so last_block is the same dict until it changes
+    """
+
+    def __init__(self, block_log: Optional[BlockLog] = None, cache_size: int = BLOCK_CACHE_SIZE)-> None:
+        self.block_log = block_log
+        self.lock = threading.RLock()
+        self.cache_size = cache_size
+        self.cache = collections.OrderedDict()
+        self.tip: Optional[dict] = None
+
+        self.indexes = array('Q')
+        self.timestamps = array('d')
+        self.proofs = array('Q')
+        self.previous_hashes = bytearray()
+        self.merkle_roots = bytearray()
+        self.hashes = bytearray()
+        # Height of each block by its raw hash
+        self.heights: Dict[bytes, int] = {}
+        # The encoding of each block, when there is no block log to read it from
+        self.encoded: List[bytes] = []
+
+        if block_log is not None:
+            for header in block_log.headers():
+                self.add_header(header)
+
+    def __len__(self)-> int:
+        return len(self.indexes)
+
+    def __getitem__(self, key):
+        with self.lock:
+            if isinstance(key, slice):
+                start, end, step = key.indices(len(self))
+                if step != 1:
+                    return [self.block(height) for height in range(start, end, step)]
+                return list(self.read_range(start, end))
+            if key < 0:
+                key += len(self)
+            if not 0 <= key < len(self):
+                raise IndexError('block height out of range')
+            return self.block(key)
+
+    def __iter__(self):
+        return self.blocks()
+
+    def blocks(self, start: int = 0):
+        # The blocks from start onwards, read CHAIN_READ_SIZE at a time.
+        # The lock is only held while each run of blocks is read, not while they are used
+        height = start
+        while True:
+            blocks = self[height:height + CHAIN_READ_SIZE]
+            if not blocks:
+                return
+            yield from blocks
+            height += len(blocks)
+
+    def read_range(self, start: int, end: int):
+        # The caller holds self.lock. Blocks not cached are read in one sequential pass over the log
+        if self.block_log is None:
+            for height in range(start, end):
+                yield self.block(height)
+            return
+
+        for height, block in zip(range(start, end), self.block_log.blocks(start, end)):
+            if height == len(self) - 1:
+                if self.tip is None:
+                    self.tip = block
+                yield self.tip
+            else:
+                yield self.cache.get(height, block)
+
+    def add_header(self, block: dict)-> None:
+        # The caller holds self.lock, or is the constructor
+        block_hash = hash_bytes(Blockchain.hash(block))
+        self.heights[block_hash] = len(self.indexes)
+        self.indexes.append(block['index'])
+        self.timestamps.append(block['timestamp'])
+        self.proofs.append(block['proof'])
+        self.previous_hashes += hash_bytes(block['previous_hash'])
+        self.merkle_roots += hash_bytes(block['merkle_root'])
+        self.hashes += block_hash
+
+    def append(self, block: dict)-> None:
+        self.extend([block])
+
+    def extend(self, blocks: List[dict])-> None:
+        """
+        Add sealed blocks to the end of the chain
+        :param blocks: <list> Blocks, each carrying its hash
+        :return: None
+        """
+
+        with self.lock:
+            for block in blocks:
+                self.add_header(block)
+                if self.block_log is None:
+                    self.encoded.append(encode_block(block))
+            if self.block_log is not None:
+                self.block_log.append(blocks)
+            if blocks:
+                self.tip = blocks[-1]
+
+    def truncate(self, height: int)-> None:
+        # Drop the blocks from height onwards
+        with self.lock:
+            if height >= len(self):
+                return
+            for position in range(height, len(self)):
+                del self.heights[bytes(self.hashes[32 * position:32 * position + 32])]
+            del self.indexes[height:], self.timestamps[height:], self.proofs[height:], self.encoded[height:]
+            del self.previous_hashes[32 * height:], self.merkle_roots[32 * height:], self.hashes[32 * height:]
+            for cached in [cached for cached in self.cache if cached >= height]:
+                del self.cache[cached]
+            self.tip = None
+            if self.block_log is not None:
+                self.block_log.truncate(height)
+
+    def block(self, height: int)-> dict:
+        # The caller holds self.lock and has checked the height
+        if height == len(self) - 1:
+            if self.tip is None:
+                self.tip = self.read(height)
+            return self.tip
+
+        block = self.cache.get(height)
+        if block is None:
+            block = self.cache[height] = self.read(height)
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        else:
+            self.cache.move_to_end(height)
+        return block
+
+    def read(self, height: int)-> dict:
+        if self.block_log is not None:
+            return self.block_log.read(height)
+        return decode_block(self.encoded[height])
+
+    def header(self, height: int)-> dict:
+        """
+        The header of a block, read from the columns alone
+        :param height: <int> Height of the block
+        :return: <dict> Every field of the block but its transactions and their hashes
+        """
+
+        with self.lock:
+            return {
+                'index': self.indexes[height],
+                'timestamp': self.timestamps[height],
+                'proof': self.proofs[height],
+                'previous_hash': self.previous_hashes[32 * height:32 * height + 32].hex(),
+                'merkle_root': self.merkle_roots[32 * height:32 * height + 32].hex(),
+                'hash': self.hashes[32 * height:32 * height + 32].hex(),
+            }
+
+    def headers(self, start: int = 0, end: Optional[int] = None)-> List[dict]:
+        with self.lock:
+            return [self.header(height) for height in range(*slice(start, end).indices(len(self)))]
+
+    def block_hash(self, height: int)-> str:
+        with self.lock:
+            if height < 0:
+                height += len(self)
+            return self.hashes[32 * height:32 * height + 32].hex()
+
+    def height_of(self, block_hash: str)-> Optional[int]:
+        """
+        Look up a block of the chain by its hash
+        :param block_hash: <str> Hash of the block
+        :return: <int> Its height, or None if it is not in the chain
+        """
+
+        try:
+            return self.heights.get(bytes.fromhex(block_hash))
+        except (TypeError, ValueError):
+            return None
+
+# Storing the blocks and transactions in SQLite for the README queries
+def transaction_io(transaction):
+    """
+    The inputs and outputs of a transaction in UTXO form. A transaction may list them as
+    input_transactions, the {'transaction_hash', 'index'} of each output it spends, and
+    output_transactions, the {'recipient', 'amount'} of each output it creates. One that
+    lists no outputs has a single output paying its amount to its recipient
+    :param transaction: <dict> Transaction
+    :return: <tuple> The list of inputs and the list of outputs
+    """
+
+    inputs = transaction.get('input_transactions') or []
+    outputs = transaction.get('output_transactions') or [
+        {'recipient': transaction.get('recipient'), 'amount': transaction.get('amount')}
+    ]
+    return inputs, outputs
+
+# Blocks missing from the store are added this many to an SQLite transaction
+INDEX_BATCH_SIZE = 1000
+
+CHAIN_STORE_SCHEMA = '''
+CREATE TABLE IF NOT EXISTS block (
+    height INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL UNIQUE,
+    timestamp REAL NOT NULL,
+    proof INTEGER NOT NULL,
+    previous_hash TEXT NOT NULL,
+    merkle_root TEXT NOT NULL,
+    transaction_count INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS tx (
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    hash TEXT NOT NULL,
+    sender TEXT,
+    recipient TEXT,
+    amount REAL,
+    input_count INTEGER NOT NULL,
+    input_total REAL NOT NULL,
+    PRIMARY KEY (height, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tx_hash ON tx (hash);
+
+CREATE TABLE IF NOT EXISTS tx_input (
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    input_index INTEGER NOT NULL,
+    previous_hash TEXT NOT NULL,
+    previous_index INTEGER NOT NULL,
+    amount REAL,
+    PRIMARY KEY (height, position, input_index)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS tx_output (
+    height INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    output_index INTEGER NOT NULL,
+    address TEXT,
+    amount REAL,
+    PRIMARY KEY (height, position, output_index)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS tx_output_address ON tx_output (address);
+
+-- Running totals over the whole chain, kept as blocks are added and rolled back
+CREATE TABLE IF NOT EXISTS totals (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    blocks INTEGER NOT NULL,
+    transactions INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO totals VALUES (0, 0, 0);
+'''
+
+class ChainStore:
+    """
+    SQLite store of the chain, normalized into blocks, transactions, inputs and outputs.
+    Blocks are keyed by height and indexed by hash, transactions are keyed by the height and
+    position that locate them and indexed by hash, so each of the README queries is an index
+    lookup rather than a table scan
+    """
+
+    def __init__(self, path: str)-> None:
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        self.lock = threading.Lock()
+        with self.lock, self.db:
+            self.db.executescript(CHAIN_STORE_SCHEMA)
+
+    def sync(self, chain: ColumnarChain)-> None:
+        # Bring the store up to date with the chain, rolling back any blocks it no longer has,
+        # and reading the missing blocks from the chain a batch at a time
+        with self.lock:
+            fork = self.db.execute('SELECT COUNT(*) FROM block').fetchone()[0]
+            while fork and (fork > len(chain) or self.block_hash(fork - 1) != chain.block_hash(fork - 1)):
+                fork -= 1
+        while True:
+            blocks = chain[fork:fork + INDEX_BATCH_SIZE]
+            self.on_tip_change(fork, blocks)
+            if len(blocks) < INDEX_BATCH_SIZE:
+                return
+            fork += len(blocks)
+
+    def block_hash(self, height: int)-> Optional[str]:
+        row = self.db.execute('SELECT hash FROM block WHERE height = ?', (height,)).fetchone()
+        return row[0] if row else None
+
+    def on_tip_change(self, fork, blocks)-> None:
+        with self.lock, self.db:
+            self.rollback(fork)
+            for height, block in enumerate(blocks, fork):
+                self.add_block(height, block)
+
+    def rollback(self, height: int)-> None:
+        # Delete the blocks from height onwards; the caller holds self.lock inside a transaction
+        removed, transactions = self.db.execute(
+            'SELECT COUNT(*), COALESCE(SUM(transaction_count), 0) FROM block WHERE height >= ?', (height,)
+        ).fetchone()
+        if not removed:
+            return
+
+        for table in ('tx_input', 'tx_output', 'tx', 'block'):
+            self.db.execute(f'DELETE FROM {table} WHERE height >= ?', (height,))
+        self.db.execute('UPDATE totals SET blocks = blocks - ?, transactions = transactions - ?', (removed, transactions))
+
+    def add_block(self, height: int, block: dict)-> None:
+        # The caller holds self.lock inside a transaction
+        transactions = block['transactions']
+        self.db.execute(
+            'INSERT INTO block VALUES (?, ?, ?, ?, ?, ?, ?)',
+            (height, Blockchain.hash(block), block['timestamp'], block['proof'], str(block['previous_hash']),
+             block['merkle_root'], len(transactions)),
+        )
+
+        ios = [transaction_io(transaction) for transaction in transactions]
+        self.db.executemany('INSERT INTO tx_output VALUES (?, ?, ?, ?, ?)', [
+            (height, position, output_index, output.get('recipient'), output.get('amount'))
+            for position, (_, outputs) in enumerate(ios)
+            for output_index, output in enumerate(outputs)
+        ])
+
+        rows = []
+        for position, (transaction, (inputs, _)) in enumerate(zip(transactions, ios)):
+            spent = [
+                (height, position, input_index, spend['transaction_hash'], spend['index'],
+                 self.output_amount(spend['transaction_hash'], spend['index']))
+                for input_index, spend in enumerate(inputs)
+            ]
+            self.db.executemany('INSERT INTO tx_input VALUES (?, ?, ?, ?, ?, ?)', spent)
+            rows.append((
+                height, position, block['transaction_hashes'][position], transaction.get('sender'),
+                transaction.get('recipient'), transaction.get('amount'), len(spent),
+                sum(amount or 0 for *_, amount in spent),
+            ))
+        self.db.executemany('INSERT INTO tx VALUES (?, ?, ?, ?, ?, ?, ?, ?)', rows)
+        self.db.execute('UPDATE totals SET blocks = blocks + 1, transactions = transactions + ?', (len(transactions),))
+
+    def output_amount(self, transaction_hash: str, index: int)-> Optional[float]:
+        # The amount of an output, from the latest transaction with that hash
+        row = self.db.execute(
+            'SELECT o.amount FROM tx JOIN tx_output AS o USING (height, position) '
+            'WHERE tx.hash = ? AND o.output_index = ? ORDER BY tx.height DESC LIMIT 1',
+            (transaction_hash, index),
+        ).fetchone()
+        return row[0] if row else None
+
+    def query(self, sql: str, parameters: tuple = ())-> List[dict]:
+        with self.lock:
+            cursor = self.db.execute(sql, parameters)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def genesis_block_hash(self, transaction_hash: str)-> Optional[str]:
+        """
+        1) Find the block hash from the transaction hash: the first block holding the transaction
+        """
+
+        rows = self.query(
+            'SELECT block.hash FROM tx JOIN block USING (height) WHERE tx.hash = ? ORDER BY tx.height LIMIT 1',
+            (transaction_hash,),
+        )
+        return rows[0]['hash'] if rows else None
+
+    def transaction_outputs(self, transaction_hash: str)-> List[dict]:
+        """
+        2) Find the addresses and amounts of the transactions with a hash
+        """
+
+        return self.query(
+            'SELECT tx.height, tx.position, o.output_index, o.address, o.amount '
+            'FROM tx JOIN tx_output AS o USING (height, position) WHERE tx.hash = ? '
+            'ORDER BY tx.height, tx.position, o.output_index',
+            (transaction_hash,),
+        )
+
+    def block(self, block_hash: str)-> Optional[dict]:
+        """
+        3) Show the block information of the block with a hash
+        """
+
+        rows = self.query('SELECT * FROM block WHERE hash = ?', (block_hash,))
+        return rows[0] if rows else None
+
+    def latest_height(self)-> Optional[int]:
+        """
+        4) Show the height of the most recent block stored
+        """
+
+        return self.query('SELECT MAX(height) AS height FROM block')[0]['height']
+
+    def latest_block(self)-> Optional[dict]:
+        """
+        5) Show the most recent block stored
+        """
+
+        rows = self.query('SELECT * FROM block ORDER BY height DESC LIMIT 1')
+        return rows[0] if rows else None
+
+    def average_transactions_per_block(self)-> Optional[float]:
+        """
+        6) The average number of transactions per block, from the running totals
+        """
+
+        totals = self.query('SELECT blocks, transactions FROM totals')[0]
+        return totals['transactions'] / totals['blocks'] if totals['blocks'] else None
+
+    def input_summary(self, height: int)-> List[dict]:
+        """
+        7) Summary of the transactions with inputs in the block at a height: for each number of
+        inputs, the number of transactions with that many inputs and their total input coins
+        """
+
+        return self.query(
+            'SELECT input_count, COUNT(*) AS transactions, SUM(input_total) AS total_input '
+            'FROM tx WHERE height = ? AND input_count > 0 GROUP BY input_count ORDER BY input_count',
+            (height,),
+        )
+
+class ChainIndexer:
+    """
+    Keeps a ChainStore in step with the chain from a background thread. Tip changes are
+    queued by the listener, which returns at once so that mining and the request threads
+    never wait on SQLite, and the indexer folds everything queued since its last write into
+    one replacement of the chain from the lowest fork point, written in a single transaction
+    """
+
+    def __init__(self, blockchain: Blockchain, store: ChainStore)-> None:
+        self.blockchain = blockchain
+        self.store = store
+        self.events = queue.Queue()
+        self.indexed_height = -1
+
+        # Changes made while catching up with the chain are queued, and replayed once it has
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        blockchain.subscribe(self.on_tip_change)
+        self.thread.start()
+
+    def on_tip_change(self, fork, blocks)-> None:
+        self.events.put((fork, list(blocks)))
+
+    def run(self)-> None:
+        try:
+            # The store may already hold most of the chain from an earlier run
+            self.store.sync(self.blockchain.chain)
+            self.indexed_height = self.store.latest_height()
+        except Exception:
+            logger.exception('Failed to catch up with the chain')
+
+        while True:
+            fork, blocks = self.events.get()
+            while True:
+                try:
+                    next_fork, next_blocks = self.events.get_nowait()
+                except queue.Empty:
+                    break
+                if next_fork < fork:
+                    fork, blocks = next_fork, next_blocks
+                else:
+                    blocks = blocks[:next_fork - fork] + next_blocks
+
+            try:
+                self.store.on_tip_change(fork, blocks)
+                self.indexed_height = fork + len(blocks) - 1
+            except Exception:
+                logger.exception('Failed to index blocks from height %d', fork)
+
+# Serving the statistics of the README queries
+class ChainStats:
+    """
+    The chain height and latest block, read from the chain, and the average number of
+    transactions per block and the input summary of a height, read from the ChainStore,
+    which keeps running totals and has the transactions of each height under its key.
+    Each is read in O(1), or O(transactions of the block), rather than by scanning the chain,
+    and nothing is held per block in memory. The store follows the chain from the indexer's
+    thread, so the figures read from it are those of the blocks it has indexed so far
+    """
+
+    def __init__(self, blockchain: Blockchain, store: ChainStore)-> None:
+        self.blockchain = blockchain
+        self.store = store
+
+    def summary(self)-> dict:
+        with self.blockchain.lock:
+            height = len(self.blockchain.chain) - 1
+            latest_block = self.blockchain.last_block
+        totals = self.store.query('SELECT blocks, transactions FROM totals')[0]
+        return {
+            'height': height,
+            'latest_block': latest_block,
+            'indexed_height': totals['blocks'] - 1,
+            'total_transactions': totals['transactions'],
+            'average_transactions_per_block': totals['transactions'] / totals['blocks'] if totals['blocks'] else None,
+        }
+
+    def input_summary(self, height: int)-> Optional[List[dict]]:
+        """
+        The transactions with inputs in the block at a height, grouped by their number of inputs
+        :param height: <int> Height of the block
+        :return: <list> Number of inputs, number of transactions and total input for each group,
+                 or None if the store holds no block at that height yet
+        """
+
+        if not self.store.query('SELECT height FROM block WHERE height = ?', (height,)):
+            return None
+        return self.store.input_summary(height)
+
+# Indexing the unspent transaction outputs
+
+# Undo records are kept for this many of the latest blocks, reorgs deeper than that rebuild the UTXO set
+UNDO_DEPTH = 1000
+
+# Version of the format of the UTXO snapshot, an older snapshot is ignored and the set rebuilt
+UTXO_SNAPSHOT_VERSION = 1
+
+def wallet_address(public_key: str)-> str:
+    # The address of a wallet is the hash of its hex encoded public key, as the users compute it
+    return hashlib.sha256(public_key.encode()).hexdigest()
+
+class UtxoSet:
+    """
+    The unspent outputs of the chain, keyed by (transaction hash, output index), with an
+    index of them by address and the balance of every address, updated as each block is
+    added. Balances and input checks are then dictionary lookups instead of chain scans.
+    Each block applied journals the outputs it spent and created, so a reorg undoes the
+    replaced blocks down to the fork point and applies only the new branch. With a snapshot
+    path, the set and its journal are saved on shutdown, and on startup only the blocks
+    added after the snapshot are applied to it
+    """
+
+    def __init__(self, blockchain: Blockchain, snapshot_path: Optional[str] = None)-> None:
+        self.blockchain = blockchain
+        self.snapshot_path = snapshot_path
+        self.lock = threading.Lock()
+        self.height = 0
+        self.outputs: Dict[Tuple[str, int], dict] = {}
+        self.addresses: Dict[str, set] = {}
+        self.balances: Dict[str, float] = {}
+        # The undo records of the latest blocks applied, one list per block of (key, created, output):
+        # an output the block spent, or an output it created in place of output (None if it was new)
+        self.journal = collections.deque(maxlen=UNDO_DEPTH)
+
+    def load(self)-> None:
+        # Apply the chain after the snapshot, or all of it, in one sequential pass over the block log, then follow its tip
+        with self.blockchain.lock:
+            if self.snapshot_path is not None:
+                self.read_snapshot()
+                atexit.register(self.save)
+            self.on_tip_change(self.height, self.blockchain.chain.blocks(self.height))
+            self.blockchain.subscribe(self.on_tip_change)
+
+    def read_snapshot(self)-> None:
+        # The caller holds the lock of the chain. A snapshot is only used if the last block it applied is still in the chain
+        try:
+            with open(self.snapshot_path) as file:
+                snapshot = json.load(file)
+        except FileNotFoundError:
+            return
+        except ValueError as error:
+            logger.warning('Ignoring the UTXO snapshot %s: %s', self.snapshot_path, error)
+            return
+
+        chain = self.blockchain.chain
+        try:
+            height = snapshot['height']
+            if snapshot['version'] != UTXO_SNAPSHOT_VERSION or not 0 < height <= len(chain) or chain.block_hash(height - 1) != snapshot['tip']:
+                logger.info('Rebuilding the UTXO set, the snapshot is not of a block of the chain')
+                return
+
+            with self.lock:
+                for transaction_hash, index, recipient, amount in snapshot['outputs']:
+                    self.create((transaction_hash, index), {'recipient': recipient, 'amount': amount})
+                for undo in snapshot['journal']:
+                    self.journal.append([
+                        ((transaction_hash, index), created, None if output is None else {'recipient': output[0], 'amount': output[1]})
+                        for transaction_hash, index, created, output in undo
+                    ])
+                self.height = height
+        except (KeyError, TypeError, ValueError) as error:
+            logger.warning('Ignoring the UTXO snapshot %s: %s', self.snapshot_path, error)
+            with self.lock:
+                self.outputs, self.addresses, self.balances = {}, {}, {}
+                self.journal.clear()
+
+    def save(self)-> None:
+        """
+        Write the set and its undo journal to the snapshot, replacing the last snapshot only once the new one is whole on disk
+        :return: None
+        """
+
+        with self.blockchain.lock, self.lock:
+            if not self.height:
+                return
+            snapshot = {
+                'version': UTXO_SNAPSHOT_VERSION,
+                'height': self.height,
+                'tip': self.blockchain.chain.block_hash(self.height - 1),
+                'outputs': [
+                    [transaction_hash, index, output.get('recipient'), output.get('amount')]
+                    for (transaction_hash, index), output in self.outputs.items()
+                ],
+                'journal': [
+                    [
+                        [transaction_hash, index, created, None if output is None else [output.get('recipient'), output.get('amount')]]
+                        for (transaction_hash, index), created, output in undo
+                    ]
+                    for undo in self.journal
+                ],
+            }
+
+        with open(self.snapshot_path + '.tmp', 'w') as file:
+            json.dump(snapshot, file, separators=(',', ':'))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(self.snapshot_path + '.tmp', self.snapshot_path)
+
+    def on_tip_change(self, fork, blocks)-> None:
+        with self.lock:
+            if self.height - fork > len(self.journal):
+                # The fork is deeper than the journal goes, so the set is built again from the new chain
+                logger.info('Rebuilding the UTXO set, the fork at height %d is past the undo journal', fork)
+                self.height = fork = 0
+                self.outputs, self.addresses, self.balances = {}, {}, {}
+                self.journal.clear()
+                blocks = self.blockchain.chain
+            while self.height > fork:
+                self.undo_block()
+            for block in blocks:
+                self.apply_block(block)
+
+    def apply_block(self, block: dict)-> None:
+        # The caller holds self.lock
+        undo = []
+        for transaction, transaction_hash in zip(block['transactions'], block['transaction_hashes']):
+            inputs, outputs = transaction_io(transaction)
+            for spend in inputs:
+                key = (spend['transaction_hash'], spend['index'])
+                output = self.spend(key)
+                if output is not None:
+                    undo.append((key, False, output))
+            for index, output in enumerate(outputs):
+                key = (transaction_hash, index)
+                undo.append((key, True, self.create(key, output)))
+        self.journal.append(undo)
+        self.height += 1
+
+    def undo_block(self)-> None:
+        # The caller holds self.lock
+        for key, created, output in reversed(self.journal.pop()):
+            if created:
+                self.spend(key)
+            if output is not None:
+                self.create(key, output)
+        self.height -= 1
+
+    def create(self, key: Tuple[str, int], output: dict)-> Optional[dict]:
+        # An output created again by a repeated transaction takes the place of the first one, which is returned
+        replaced = self.spend(key)
+        address = output.get('recipient')
+        self.outputs[key] = output
+        self.addresses.setdefault(address, set()).add(key)
+        self.balances[address] = self.balances.get(address, 0) + (output.get('amount') or 0)
+        return replaced
+
+    def spend(self, key: Tuple[str, int])-> Optional[dict]:
+        output = self.outputs.pop(key, None)
+        if output is None:
+            return None
+
+        address = output.get('recipient')
+        keys = self.addresses[address]
+        keys.discard(key)
+        if keys:
+            self.balances[address] -= output.get('amount') or 0
+        else:
+            del self.addresses[address]
+            del self.balances[address]
+        return output
+
+    def balance(self, address: str)-> dict:
+        with self.lock:
+            return {
+                'address': address,
+                'balance': self.balances.get(address, 0),
+                'outputs': len(self.addresses.get(address, ())),
+            }
+
+    def unspent(self, address: str)-> List[dict]:
+        """
+        The unspent outputs of an address, as inputs of a new transaction would name them
+        :param address: <str> Address of the wallet
+        :return: <list> The transaction hash, index and amount of each
+        """
+
+        with self.lock:
+            return [
+                {'transaction_hash': transaction_hash, 'index': index, 'amount': self.outputs[(transaction_hash, index)].get('amount')}
+                for transaction_hash, index in sorted(self.addresses.get(address, ()))
+            ]
+
+    def validate(self, transaction: dict, sender: Optional[str] = None)-> Optional[str]:
+        """
+        Check that a transaction spends outputs that are unspent, each once, that they belong to
+        the sender if one is given, and that they add up to at least what the transaction pays out
+        :param transaction: <dict> Transaction, with its input_transactions and output_transactions
+        :param sender: (Optional) <str> Hex encoded public key of the sender
+        :return: <str> Why the transaction is invalid, or None if it is valid
+        """
+
+        inputs, outputs = transaction_io(transaction)
+        owner = wallet_address(sender) if sender is not None else None
+
+        with self.lock:
+            total = 0
+            seen = set()
+            for spend in inputs:
+                key = (spend.get('transaction_hash'), spend.get('index'))
+                if key in seen:
+                    return f'Output {key[0]}:{key[1]} is spent twice'
+                seen.add(key)
+
+                output = self.outputs.get(key)
+                if output is None:
+                    return f'Output {key[0]}:{key[1]} does not exist or is already spent'
+                if owner is not None and output.get('recipient') != owner:
+                    return f'Output {key[0]}:{key[1]} does not belong to the sender'
+                total += output.get('amount') or 0
+
+        paid = sum(output.get('amount') or 0 for output in outputs)
+        if paid > total:
+            return f'Outputs pay {paid} but the inputs only hold {total}'
+        return None
+
+# Verifying transaction signatures in parallel
+
+# Each worker process keeps the verifiers of this many recent senders, so repeat senders skip key parsing
+VERIFIER_CACHE_SIZE = 1024
+
+@functools.lru_cache(maxsize=VERIFIER_CACHE_SIZE)
+def load_verifier(scheme, sender):
+    # Parse the sender's public key into a verifier, raising KeyError or ValueError if either is unknown or malformed
+    return SIGNATURE_SCHEMES[scheme].verifier(binascii.unhexlify(sender.encode('ascii')))
+
+def verify_signature(sender, transaction, signature, scheme='rsa')-> bool:
+    """
+    Check the signature of a transaction against the sender's public key
+    :param sender: <str> Hex of the sender's DER encoded public key
+    :param transaction: <dict> The signed transaction
+    :param signature: <str> Hex of the signature
+    :param scheme: <str> Name of the signature scheme, one of SIGNATURE_SCHEMES
+    :return: <bool> True if the signature is authentic, False if not or if any part is malformed
+    """
+
+    try:
+        verify = load_verifier(scheme, sender)
+        signature = binascii.unhexlify(signature.encode('ascii'))
+        message = str(collections.OrderedDict(transaction)).encode('utf8')
+    except (TypeError, ValueError, KeyError, AttributeError):
+        return False
+
+    return verify(message, signature)
+
+def _verify_signatures(items)-> tuple:
+    # The results, with the counters of this worker's verifier cache
+    verified = [verify_signature(*item) for item in items]
+    info = load_verifier.cache_info()
+    return verified, os.getpid(), info.hits, info.misses, info.currsize
+
+class SignatureVerifier:
+    """
+    Verifies transaction signatures in a pool of worker processes, one per core. Batches are split
+    into chunks verified in parallel, and at most max_pending chunks wait in the pool's queue:
+    once it is full, callers wait up to queue_timeout seconds and are then turned away
+    """
+
+    def __init__(self, workers: Optional[int] = None, max_pending: int = 1024, chunk_size: int = 64, queue_timeout: float = 1)-> None:
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.pending = threading.BoundedSemaphore(max_pending)
+        self.chunk_size = chunk_size
+        self.queue_timeout = queue_timeout
+        # pid -> (hits, misses, size) of each worker's verifier cache, as last reported
+        self.cache_stats = {}
+        self.stats_lock = threading.Lock()
+
+    def verify(self, items: List[tuple])-> Optional[List[bool]]:
+        """
+        Verify a batch of signatures
+        :param items: <list> (sender, transaction, signature, scheme) of each signed transaction, as for verify_signature
+        :return: <list> Whether each signature is authentic, or None if the queue was full
+        """
+
+        futures = []
+        for i in range(0, len(items), self.chunk_size):
+            if not self.pending.acquire(timeout=self.queue_timeout):
+                for future in futures:
+                    future.cancel()
+                return None
+
+            future = self.pool.submit(_verify_signatures, items[i:i + self.chunk_size])
+            future.add_done_callback(lambda _: self.pending.release())
+            futures.append(future)
+
+        results = []
+        for future in futures:
+            verified, pid, hits, misses, size = future.result()
+            results.extend(verified)
+            with self.stats_lock:
+                self.cache_stats[pid] = (hits, misses, size)
+        return results
+
+    def stats(self)-> dict:
+        # Counters of the verifier caches, summed over the worker processes
+        with self.stats_lock:
+            stats = list(self.cache_stats.values())
+        return {
+            'workers': len(stats),
+            'hits': sum(hits for hits, _, _ in stats),
+            'misses': sum(misses for _, misses, _ in stats),
+            'cached_senders': sum(size for _, _, size in stats),
+        }
+
+# Streaming transaction ingestion
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+def iter_json_array(stream, chunk_size=65536):
+    """
+    Decode the items of a JSON array one at a time, reading the stream a chunk at a time
+    :param stream: Binary file-like object holding the array
+    :return: Generator of the items, raising ValueError if the array is malformed
+    """
+
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')()
+    buffer, position, started = '', 0, False
+    while True:
+        chunk = stream.read(chunk_size)
+        buffer = buffer[position:] + utf8.decode(chunk, final=not chunk)
+        position = 0
+
+        while True:
+            position = _WHITESPACE.match(buffer, position).end()
+            if position == len(buffer):
+                break
+
+            if not started:
+                if buffer[position] != '[':
+                    raise ValueError('Expected a JSON array')
+                started = True
+                position += 1
+            elif buffer[position] == ']':
+                return
+            elif buffer[position] == ',':
+                position += 1
+            else:
+                try:
+                    item, end = decoder.raw_decode(buffer, position)
+                except json.JSONDecodeError:
+                    if not chunk:
+                        raise
+                    break # the item continues in the next chunk
+
+                # A number or literal at the end of the buffer may continue in the next chunk
+                if end == len(buffer) and chunk:
+                    break
+                yield item
+                position = end
+
+        if not chunk:
+            raise ValueError('Unterminated JSON array')
+
+def iter_ndjson(stream):
+    """
+    Decode newline delimited JSON one line at a time
+    :param stream: Binary file-like object holding one JSON document per line
+    :return: Generator of the documents, None for a line that is not valid JSON
+    """
+
+    for line in stream:
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield None
+
+def valid_transaction_values(values):
+    # Senders and recipients must be strings, amounts numbers and nonces 64 bit numbers, as the binary encoding holds them
+    return (
+        isinstance(values['sender'], str) and isinstance(values['recipient'], str)
+        and is_amount(values['amount']) and is_amount(values.get('fee', 0))
+        and (values.get('nonce') is None or is_nonce(values['nonce']))
+    )
+
+def ingest_transactions(items):
+    """
+    Validate a stream of transactions and admit them to the mempool a batch at a time. If the
+    stream turns out to be malformed part way, the transactions read before are still admitted
+    :param items: Iterable of transactions, None for one that could not be decoded
+    :return: <tuple> The result for each transaction read, in order, and the error that ended the
+             stream early, or None if it was read to the end
+    """
+
+    required = ['sender', 'recipient', 'amount']
+    results = []
+    batch = []
+
+    def admit():
+        indexes = blockchain.new_transactions([entry for _, entry in batch])
+        for (position, _), index in zip(batch, indexes):
+            if index is None:
+                results[position] = {'status': 'rejected', 'message': 'Duplicate transaction, or mempool full'}
+            else:
+                results[position] = {'status': 'accepted', 'index': index}
+        batch.clear()
+
+    error = None
+    items = iter(items)
+    while True:
+        try:
+            values = next(items)
+        except StopIteration:
+            break
+        except ValueError as malformed:
+            error = str(malformed)
+            break
+
+        if values is None:
+            results.append({'status': 'invalid', 'message': 'Malformed JSON'})
+            continue
+        if not isinstance(values, dict) or not all(k in values for k in required):
+            results.append({'status': 'invalid', 'message': 'Missing values'})
+            continue
+        if not valid_transaction_values(values):
+            results.append({'status': 'invalid', 'message': 'Invalid values'})
+            continue
+
+        results.append(None)
+        batch.append((len(results) - 1, (values['sender'], values['recipient'], values['amount'], values.get('fee', 0), values.get('nonce'))))
+        if len(batch) == INGEST_BATCH_SIZE:
+            admit()
+
+    if batch:
+        admit()
+    return results, error
+
+def admit_signed_transactions(values):
+    """
+    Verify a batch of signed transactions, and admit to the mempool those whose signature is authentic
+    and which only spend unspent outputs of their sender
+    :param values: <list> Signed transactions, each with its sender, transaction, signature and scheme
+    :return: <list> The result for each transaction, in order, or None if too many transactions
+             are already waiting for verification
+    """
+
+    items = [
+        (value.get("sender"), value.get("transaction"), value.get("signature"), value.get("scheme", "rsa"))
+        for value in values
+    ]
+    verified = signature_verifier.verify(items)
+    if verified is None:
+        return None
+
+    results = []
+    batch = []
+    for (sender, signed, _, _), authentic in zip(items, verified):
+        if not authentic or not isinstance(signed, dict):
+            results.append({'status': 'unauthentic', 'message': 'The signature is not authentic'})
+            continue
+
+        # The transaction is admitted as it was signed, from the wallet of the key that signed it
+        transaction = dict(signed, sender=wallet_address(sender))
+        try:
+            Blockchain.hash_transaction(transaction)
+        except ValueError as error:
+            results.append({'status': 'invalid', 'message': str(error)})
+            continue
+
+        # Check that the transaction only spends unspent outputs of the sender
+        error = utxo_set.validate(transaction, sender)
+        if error is not None:
+            results.append({'status': 'invalid', 'message': error})
+            continue
+
+        results.append(None)
+        batch.append((len(results) - 1, transaction))
+
+    indexes = blockchain.new_signed_transactions([transaction for _, transaction in batch])
+    for (position, _), index in zip(batch, indexes):
+        if index is None:
+            results[position] = {'status': 'rejected', 'message': 'Duplicate transaction, output already spent in the mempool, or mempool full'}
+        else:
+            results[position] = {'status': 'accepted', 'index': index}
+    return results
+
 # instantiate our node
 app = Flask(__name__)
 
-# Generate a globally unique address for this node
-node_identifier = str(uuid4()).replace('-', '')
+# Port this miner listens on
+PORT = 5002
+
+# The parts of the node, set up by start_node when the miner is run. Importing this module, as
+# benchmark.py does and as worker processes started with spawn do, opens no files and starts nothing
+node_identifier = None
+blockchain = None
+mining_worker = None
+chain_store = None
+chain_indexer = None
+chain_stats = None
+utxo_set = None
+signature_verifier = None
+
+def start_node(port=PORT):
+    """
+    Open the chain and the stores of a node in the working directory, and start its background workers
+    :param port: <int> Port the node listens on, which names its files
+    :return: None
+    """
+
+    global node_identifier, blockchain, mining_worker, chain_store, chain_indexer, chain_stats, utxo_set, signature_verifier
+
+    # Generate a globally unique address for this node
+    node_identifier = str(uuid4()).replace('-', '')
+
+    # instantiate the blockchain, kept on disk across restarts
+    blockchain = Blockchain(log_path=f'blocks-{port}.log')
+
+    # mine in worker processes so the HTTP server keeps answering requests
+    mining_worker = MiningWorker(blockchain, node_identifier)
+
+    # store the blocks and transactions in SQLite for the README queries, indexed in the background,
+    # and serve the statistics of the README queries for the dashboards from there
+    chain_store = ChainStore(f'chain-{port}.db')
+    chain_indexer = ChainIndexer(blockchain, chain_store)
+    chain_stats = ChainStats(blockchain, chain_store)
+
+    # index the unspent outputs for balances and for checking the inputs of transactions
+    utxo_set = UtxoSet(blockchain, snapshot_path=f'utxo-{port}.json')
+    utxo_set.load()
 
-# instantiate the blockchain
-blockchain = Blockchain()
+    # verify signatures in worker processes, off the request threads
+    signature_verifier = SignatureVerifier()
 
 @app.route('/mine', methods=['GET'])
 def mine():
-    # We run the proof of work algorithm to get the next proof...
-    last_block = blockchain.last_block
-    last_proof = last_block['proof']
-    proof = blockchain.proof_of_work(last_proof)
-
-    # We must receive a reward for finding the proof.
-    # The sender is "0" to signify that this node has mined a new coin.
-    blockchain.new_transaction(
-        sender="0",
-        recipient=node_identifier,
-        amount=1,
-    )
+    # Mine a single block in the background, its progress is reported by /mine/status
+    started = mining_worker.start()
+
+    response = {
+        'message': "Mining started" if started else "Already mining",
+        'status': mining_worker.status(),
+    }
+
+    return jsonify(response), 202
+
+@app.route('/mine/start', methods=['POST'])
+def start_mining():
+    # Keep mining block after block until /mine/stop
+    started = mining_worker.start(continuous=True)
+
+    response = {
+        'message': "Mining started" if started else "Already mining",
+        'status': mining_worker.status(),
+    }
 
-    # Forge the new Block by adding it to the chain
-    previous_hash = blockchain.hash(last_block)
-    block = blockchain.new_block(proof, previous_hash)
+    return jsonify(response), 202
+
+@app.route('/mine/stop', methods=['POST'])
+def stop_mining():
+    stopped = mining_worker.stop()
 
     response = {
-        'message': "New Block Forged",
-        'index': block['index'],
-        'transactions': block['transactions'],
-        'proof': block['proof'],
-        'previous_hash': block['previous_hash'],
+        'message': "Mining stopped" if stopped else "Not mining",
+        'status': mining_worker.status(),
     }
 
     return jsonify(response), 200
 
+@app.route('/mine/status', methods=['GET'])
+def mining_status():
+    return jsonify(mining_worker.status()), 200
+
 
 @app.route('/transactions/new', methods=['POST'])
 def new_transaction():
@@ -299,20 +2719,185 @@ def new_transaction():
     required = ['sender', 'recipient', 'amount']
     if not all(k in values for k in required):
         return 'Missing values', 400
+    if not valid_transaction_values(values):
+        return 'Invalid values', 400
 
     # Create a new Transaction
-    index = blockchain.new_transaction(values['sender'], values['recipient'], values['amount'])
+    index = blockchain.new_transaction(values['sender'], values['recipient'], values['amount'], values.get('fee', 0), values.get('nonce'))
+    if index is None:
+        return 'Duplicate transaction, or mempool full', 409
 
     response = {'message': f'Transaction will be added to Block {index}'}
     return jsonify(response), 201
 
+@app.route('/mempool', methods=['GET'])
+def mempool_status():
+    with blockchain.lock:
+        response = blockchain.mempool.stats()
+        response['order'] = blockchain.block_order
+
+    return jsonify(response), 200
+
+@app.route('/mempool/order', methods=['POST'])
+def mempool_order():
+    # Take the transactions of the next blocks first come first served, or the highest fees first
+    values = request.get_json(silent=True)
+    order = values.get('order') if isinstance(values, dict) else None
+    if order not in BLOCK_ORDERS:
+        return f'Expected an order, one of {", ".join(BLOCK_ORDERS)}', 400
+
+    with blockchain.lock:
+        blockchain.block_order = order
+
+    response = {'message': f'Blocks take transactions by {order}', 'order': order}
+    return jsonify(response), 200
+
+@app.route('/transactions/batch', methods=['POST'])
+def new_transactions():
+    # The body is either a JSON array of transactions or, as application/x-ndjson, one transaction per line.
+    # It is read as a stream, never whole, and every transaction gets its own result
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl'):
+        items = iter_ndjson(request.stream)
+    else:
+        items = iter_json_array(request.stream)
+
+    results, error = ingest_transactions(items)
+
+    response = {
+        'accepted': sum(result['status'] == 'accepted' for result in results),
+        'results': results,
+    }
+    if error is not None:
+        # The transactions before the malformed part were admitted all the same, so say which
+        response['error'] = f'Malformed JSON array: {error}'
+        return jsonify(response), 400
+    return jsonify(response), 200
+
+def iter_chain(start, hashes, headers_only, binary):
+    """
+    Encode a range of blocks one at a time, for a streamed /chain response. The blocks are
+    read CHAIN_READ_SIZE at a time, in one sequential pass over the block log for each run
+    :param start: <int> Height of the first block
+    :param hashes: <bytes> Raw hashes of the blocks of the range when the response started;
+                   the range ends early at a block that has since been replaced
+    :param headers_only: <bool> Encode only the headers of the blocks
+    :param binary: <bool> Encode the blocks in binary rather than as a JSON array
+    :return: Generator of the encoded blocks
+    """
+
+    chain = blockchain.chain
+    end = start + len(hashes) // 32
+    for run_start in range(start, end, CHAIN_READ_SIZE):
+        run_end = min(run_start + CHAIN_READ_SIZE, end)
+        with chain.lock:
+            # The run stops short at the first block that is no longer the one the response started with
+            stop = min(run_end, len(chain))
+            if chain.hashes[32 * run_start:32 * stop] != hashes[32 * (run_start - start):32 * (stop - start)]:
+                stop = run_start
+                while chain.hashes[32 * stop:32 * stop + 32] == hashes[32 * (stop - start):32 * (stop - start) + 32]:
+                    stop += 1
+            blocks = chain.headers(run_start, stop) if headers_only else list(chain.read_range(run_start, stop))
+
+        for block in blocks:
+            if not binary:
+                yield json.dumps(block, sort_keys=True)
+            elif headers_only:
+                yield encode_header(block)
+            else:
+                yield encode_blocks([block])
+        if stop < run_end:
+            return
+
+def iter_json_chain(blocks, length):
+    # The JSON response of /chain, {"chain": [...], "length": length}, a block at a time
+    yield '{"chain": ['
+    for position, block in enumerate(blocks):
+        yield block if not position else ', ' + block
+    yield f'], "length": {length}}}'
+
 @app.route('/chain', methods=['GET'])
 def full_chain():
+    # Blocks can be requested by height, from start (or offset) up to but excluding end, or at most limit
+    # blocks, and as headers only, which carry the hash of each block instead of its transactions.
+    # The response is streamed a block at a time, and tagged with the hash of the tip of the chain,
+    # so that a poll with If-None-Match gets a 304 without a body until the chain changes
+    start = request.args.get('offset', request.args.get('start', 0, type=int), type=int)
+    end = request.args.get('end', type=int)
+    limit = request.args.get('limit', type=int)
+    headers_only = request.args.get('headers') in ('1', 'true')
+
+    # Peers ask for the binary encoding of the blocks, anyone else gets JSON
+    mimetype = request.accept_mimetypes.best_match(['application/json', 'application/octet-stream'])
+    binary = mimetype == 'application/octet-stream'
+
+    chain = blockchain.chain
+    with chain.lock:
+        length = len(chain)
+        tip = chain.block_hash(-1)
+        start, end, _ = slice(start, end).indices(length)
+        if limit is not None:
+            end = min(end, start + max(limit, 0))
+        hashes = bytes(chain.hashes[32 * start:32 * max(start, end)])
+
+    etag = f'{tip}-{"binary" if binary else "json"}'
+    headers = {
+        'ETag': f'"{etag}"',
+        'Vary': 'Accept',
+        'X-Chain-Tip': tip,
+        'X-Chain-Length': str(length),
+    }
+    if etag in request.if_none_match:
+        return '', 304, headers
+
+    blocks = iter_chain(start, hashes, headers_only, binary)
+    if binary:
+        return Response(blocks, 200, headers, mimetype='application/octet-stream')
+    return Response(iter_json_chain(blocks, length), 200, headers, mimetype='application/json')
+
+@app.route('/stats', methods=['GET'])
+def stats():
+    return jsonify(chain_stats.summary()), 200
+
+@app.route('/stats/inputs/<int:height>', methods=['GET'])
+def input_stats(height):
+    summary = chain_stats.input_summary(height)
+    if summary is None:
+        if 0 <= height < len(blockchain.chain):
+            return 'Block not indexed yet', 503
+        return 'Block not found', 404
+
     response = {
-        'chain': blockchain.chain,
-        'length': len(blockchain.chain),
+        'height': height,
+        'summary': summary,
     }
+    return jsonify(response), 200
+
+@app.route('/balance/<address>', methods=['GET'])
+def balance(address):
+    # The unspent outputs themselves are listed with ?outputs=1
+    response = utxo_set.balance(address)
+    if request.args.get('outputs') in ('1', 'true'):
+        response['unspent'] = utxo_set.unspent(address)
+
+    return jsonify(response), 200
+
+@app.route('/transactions/proof', methods=['GET'])
+def transaction_proof():
+    height = request.args.get('height', type=int)
+    transaction_hash = request.args.get('hash')
+    if height is None or transaction_hash is None:
+        return 'Missing values', 400
+
+    proof = blockchain.merkle_proof(height, transaction_hash)
+    if proof is None:
+        return 'Transaction not found', 404
 
+    response = {
+        'height': height,
+        'hash': transaction_hash,
+        'merkle_root': blockchain.chain.header(height)['merkle_root'],
+        'proof': proof,
+    }
     return jsonify(response), 200
 
 @app.route('/nodes/register', methods=['POST'])
@@ -340,45 +2925,62 @@ def consensus():
     if replaced:
         response = {
             'message': 'Our chain was replaced',
-            'new_chain': blockchain.chain
+            'new_chain': blockchain.chain[:]
         }
     else:
         response = {
             'message': 'Our chain is authoritative',
-            'chain': blockchain.chain
+            'chain': blockchain.chain[:]
         }
 
     return jsonify(response), 200
 
 @app.route('/handle_transaction', methods = ['POST'])
 def handle_transaction():
-    json = request.get_json()
-
-    signature = json.get("signature")
-    signature = binascii.unhexlify(signature.encode('ascii'))
-
-    transaction = json.get("transaction")
+    values = request.get_json(silent=True)
+    if not isinstance(values, dict):
+        return 'Expected a signed transaction', 400
+
+    results = admit_signed_transactions([values])
+    if results is None:
+        return 'Too many transactions waiting for verification', 503
+
+    result = results[0]
+    if result['status'] == 'unauthentic':
+        return result['message'], 403
+    if result['status'] == 'invalid':
+        return result['message'], 400
+    if result['status'] == 'rejected':
+        return result['message'], 409
+
+    response = {'message': f"Transaction will be added to Block {result['index']}"}
+    return jsonify(response), 200
 
-    sender = json.get("sender")
-    sender = RSA.importKey(binascii.unhexlify(sender.encode('ascii')))
-    
-    verifier = PKCS1_v1_5.new(sender)
+@app.route('/handle_transactions', methods = ['POST'])
+def handle_transactions():
+    # A JSON array of signed transactions, as sent one at a time to /handle_transaction,
+    # whose signatures are verified in parallel across the worker processes
+    values = request.get_json(silent=True)
+    if not isinstance(values, list) or not all(isinstance(value, dict) for value in values):
+        return 'Expected a list of signed transactions', 400
 
-    h = SHA.new(str(collections.OrderedDict(transaction)).encode('utf8'))
+    results = admit_signed_transactions(values)
+    if results is None:
+        return 'Too many transactions waiting for verification', 503
 
-    if verifier.verify(h, signature):
-       print("The signature is authentic.")
-    else:
-       print("The signature is not authentic.")
-    
-    # broadcast the transaction
-    blockchain.broadcast_transaction(json["sender"], json['transaction']["recipient"], json['transaction']["input_transactions"], json['transaction']["output_transactions"])
-
-    response = {'message': "Received transaction"}
+    response = {
+        'accepted': sum(result['status'] == 'accepted' for result in results),
+        'results': results,
+    }
     return jsonify(response), 200
 
+@app.route('/handle_transaction/stats', methods = ['GET'])
+def verifier_stats():
+    return jsonify(signature_verifier.stats()), 200
+
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5002)
+    start_node(PORT)
+    app.run(host='0.0.0.0', port=PORT)
 
 class Block:
 
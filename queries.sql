@@ -90,3 +90,28 @@ SELECT AVG(no_of_transactions) FROM block;
 SELECT no_of_transactions, coins FROM block WHERE index_id=6;
 
 
+
+-- The miners also keep their chain in an embedded SQLite store (chain-<port>.db), normalized
+-- into block, tx, tx_input and tx_output tables (see CHAIN_STORE_SCHEMA in miner-1.py).
+-- The same seven queries against it, each an index lookup:
+
+-- 1) Block hash from the transaction hash
+SELECT block.hash FROM tx JOIN block USING (height) WHERE tx.hash = ? ORDER BY tx.height LIMIT 1;
+
+-- 2) Addresses and amounts of the transaction
+SELECT o.output_index, o.address, o.amount FROM tx JOIN tx_output AS o USING (height, position) WHERE tx.hash = ?;
+
+-- 3) Block information of the block with a hash
+SELECT * FROM block WHERE hash = ?;
+
+-- 4) Height of the most recent block
+SELECT MAX(height) FROM block;
+
+-- 5) Most recent block
+SELECT * FROM block ORDER BY height DESC LIMIT 1;
+
+-- 6) Average number of transactions per block, from the running totals
+SELECT CAST(transactions AS REAL) / blocks FROM totals;
+
+-- 7) Summary of the transactions with inputs in the block with height 6
+SELECT input_count, COUNT(*), SUM(input_total) FROM tx WHERE height = 6 AND input_count > 0 GROUP BY input_count;
@@ -0,0 +1,14 @@
+# The miner is a script, so its module is loaded from its file; importing it opens no files
+import importlib.util
+import os
+
+import pytest
+
+MINER_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'miner-1.py')
+
+@pytest.fixture(scope='session')
+def miner():
+    spec = importlib.util.spec_from_file_location('miner', MINER_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
@@ -0,0 +1,106 @@
+import os
+
+import pytest
+
+def sealed_blocks(miner, count):
+    blocks = []
+    previous_hash = 1
+    for index in range(1, count + 1):
+        transactions = [{'sender': '0', 'recipient': f'miner-{index}', 'amount': 1, 'block': index}]
+        hashes = [miner.Blockchain.hash_transaction(transaction) for transaction in transactions]
+        block = {
+            'index': index,
+            'timestamp': 1700000000.0 + index,
+            'proof': index,
+            'previous_hash': previous_hash,
+            'merkle_root': miner.Blockchain.merkle_root(hashes),
+            'transactions': transactions,
+            'transaction_hashes': hashes,
+        }
+        block['hash'] = previous_hash = miner.Blockchain.compute_hash(block)
+        blocks.append(block)
+    return blocks
+
+@pytest.fixture
+def log_path(tmp_path):
+    return str(tmp_path / 'blocks.log')
+
+def write_log(miner, path, blocks):
+    log = miner.BlockLog(path)
+    log.append(blocks)
+    log.close()
+
+def read_log(miner, path):
+    log = miner.BlockLog(path)
+    try:
+        return [(block['hash'], block['transactions']) for block in log]
+    finally:
+        log.close()
+
+def summary(blocks):
+    return [(block['hash'], block['transactions']) for block in blocks]
+
+def test_blocks_read_back(miner, log_path):
+    blocks = sealed_blocks(miner, 5)
+    write_log(miner, log_path, blocks)
+
+    assert read_log(miner, log_path) == summary(blocks)
+
+def test_torn_record_is_cut_off(miner, log_path):
+    blocks = sealed_blocks(miner, 5)
+    write_log(miner, log_path, blocks)
+    size = os.path.getsize(log_path)
+
+    # A crash in the middle of an append leaves a record whose payload is shorter than its length
+    with open(log_path, 'ab') as log:
+        log.write(miner.BlockLog.RECORD.pack(100, 0) + b'\x01' * 10)
+
+    assert read_log(miner, log_path) == summary(blocks)
+    assert os.path.getsize(log_path) == size
+    assert os.path.getsize(log_path + '.idx') == 8 * len(blocks)
+
+def test_corrupt_last_record_is_dropped(miner, log_path):
+    blocks = sealed_blocks(miner, 5)
+    write_log(miner, log_path, blocks[:4])
+    size = os.path.getsize(log_path)
+    write_log(miner, log_path, blocks[4:])
+
+    with open(log_path, 'r+b') as log:
+        log.seek(-1, os.SEEK_END)
+        last = log.read(1)
+        log.seek(-1, os.SEEK_END)
+        log.write(bytes([last[0] ^ 0xff]))
+
+    assert read_log(miner, log_path) == summary(blocks[:4])
+    assert os.path.getsize(log_path) == size
+
+@pytest.mark.parametrize('index_size', [0, 8, 8 * 3 + 5])
+def test_index_behind_the_log_is_rebuilt(miner, log_path, index_size):
+    blocks = sealed_blocks(miner, 5)
+    write_log(miner, log_path, blocks)
+
+    with open(log_path + '.idx', 'r+b') as index:
+        index.truncate(index_size)
+
+    assert read_log(miner, log_path) == summary(blocks)
+    assert os.path.getsize(log_path + '.idx') == 8 * len(blocks)
+
+def test_appends_after_recovery(miner, log_path):
+    blocks = sealed_blocks(miner, 6)
+    write_log(miner, log_path, blocks[:3])
+    with open(log_path, 'ab') as log:
+        log.write(b'\x00\x01')
+
+    write_log(miner, log_path, blocks[3:])
+
+    assert read_log(miner, log_path) == summary(blocks)
+
+def test_truncate(miner, log_path):
+    blocks = sealed_blocks(miner, 5)
+    log = miner.BlockLog(log_path)
+    log.append(blocks)
+    log.truncate(2)
+    log.append(blocks[2:3])
+    log.close()
+
+    assert read_log(miner, log_path) == summary(blocks[:3])
@@ -0,0 +1,107 @@
+import struct
+
+import pytest
+
+TRANSACTIONS = [
+    {'sender': 'alice', 'recipient': 'bob', 'amount': 5, 'nonce': 7},
+    {'sender': 'alice', 'recipient': 'bob', 'amount': 2.5, 'fee': 1, 'nonce': 2 ** 64 - 1},
+    {'sender': '0', 'recipient': 'miner', 'amount': 1, 'block': 300},
+    {'sender': 'wallet', 'recipient': 'bob', 'input_transactions': [{'transaction_hash': 'ab' * 32, 'index': 3}],
+     'output_transactions': [{'recipient': 'bob', 'amount': 7}, {'recipient': 'wallet', 'amount': -0.5}]},
+    {'recipient': 'é' * 200, 'input_transactions': [], 'output_transactions': []},
+    {},
+]
+
+def block(miner, transactions, index=2):
+    hashes = [miner.Blockchain.hash_transaction(transaction) for transaction in transactions]
+    return {
+        'index': index,
+        'timestamp': 1700000000.25,
+        'proof': 35293,
+        'previous_hash': 'cd' * 32,
+        'merkle_root': miner.Blockchain.merkle_root(hashes),
+        'transactions': transactions,
+        'transaction_hashes': hashes,
+    }
+
+@pytest.mark.parametrize('transaction', TRANSACTIONS)
+def test_transaction_round_trip(miner, transaction):
+    encoded = miner.encode_transaction(transaction)
+    decoded = miner.decode_transaction(encoded)
+
+    assert decoded == transaction
+    assert [type(decoded[field]) for field in decoded] == [type(transaction[field]) for field in decoded]
+    assert miner.encode_transaction(decoded) == encoded
+
+def test_transaction_encoding_ignores_key_order(miner):
+    transaction = TRANSACTIONS[1]
+    reordered = dict(reversed(list(transaction.items())))
+
+    assert miner.encode_transaction(reordered) == miner.encode_transaction(transaction)
+
+def test_block_round_trip(miner):
+    original = block(miner, TRANSACTIONS)
+    decoded = miner.decode_block(miner.encode_block(original))
+
+    assert decoded.pop('hash') == miner.Blockchain.compute_hash(original)
+    assert decoded == original
+
+def test_blocks_round_trip(miner):
+    blocks = [block(miner, TRANSACTIONS[:count], index) for index, count in enumerate(range(len(TRANSACTIONS)), 1)]
+    decoded = miner.decode_blocks(miner.encode_blocks(blocks))
+
+    assert [block.pop('hash') for block in decoded] == [miner.Blockchain.compute_hash(block) for block in blocks]
+    assert decoded == blocks
+
+def test_header_round_trip(miner):
+    original = block(miner, TRANSACTIONS)
+    header = miner.decode_header(miner.encode_header(original))
+
+    assert header['hash'] == miner.Blockchain.compute_hash(original)
+    assert {field: original[field] for field in header if field != 'hash'} == {field: header[field] for field in header if field != 'hash'}
+
+@pytest.mark.parametrize('transaction', [
+    {'sender': 'alice', 'memo': 'x'},
+    {'sender': 1},
+    {'amount': True},
+    {'amount': float('nan')},
+    {'nonce': -1},
+    {'input_transactions': [{'transaction_hash': 'ab', 'index': 0}]},
+    {'output_transactions': [{'recipient': 'bob'}]},
+    ['sender', 'alice'],
+])
+def test_unencodable_transaction(miner, transaction):
+    with pytest.raises(ValueError):
+        miner.encode_transaction(transaction)
+
+def non_canonical(miner):
+    sender = miner.encode_transaction({'sender': 'alice'})
+    recipient = miner.encode_transaction({'recipient': 'bob'})
+    amount = miner.encode_transaction({'amount': 5})
+    return {
+        'empty': b'',
+        'unknown version': bytes([miner.CODEC_VERSION + 1]) + sender[1:],
+        'unknown field': sender + bytes([len(miner.TRANSACTION_FIELDS)]),
+        'fields out of order': recipient + sender[1:],
+        'field repeated': sender + sender[1:],
+        'varint longer than needed': bytes([miner.CODEC_VERSION, 0, 0x85, 0x00]) + b'alice',
+        'truncated string': sender[:-1],
+        'truncated amount': amount[:-1],
+        'unknown amount type': amount[:2] + b'\x02' + amount[3:],
+        'amount not finite': amount[:2] + b'\x01' + struct.pack('>d', float('inf')),
+    }
+
+@pytest.mark.parametrize('case', [
+    'empty', 'unknown version', 'unknown field', 'fields out of order', 'field repeated',
+    'varint longer than needed', 'truncated string', 'truncated amount', 'unknown amount type', 'amount not finite',
+])
+def test_non_canonical_transaction_is_rejected(miner, case):
+    with pytest.raises(ValueError):
+        miner.decode_transaction(non_canonical(miner)[case])
+
+def test_non_canonical_block_is_rejected(miner):
+    encoded = miner.encode_block(block(miner, TRANSACTIONS))
+
+    for data in (encoded + b'\x00', encoded[:-1], encoded[:miner.BLOCK_HEADER.size - 1]):
+        with pytest.raises(ValueError):
+            miner.decode_block(data)
@@ -0,0 +1,34 @@
+import hashlib
+
+import pytest
+
+def values(count):
+    return [hashlib.sha256(str(i).encode()).hexdigest() for i in range(count)]
+
+@pytest.mark.parametrize('count', list(range(1, 34)) + [100, 255, 256, 257])
+def test_accumulator_root_matches_tree(miner, count):
+    accumulator = miner.MerkleAccumulator()
+    for value in values(count):
+        accumulator.append(value)
+
+    assert accumulator.getRootHash() == miner.MerkleTree(values(count)).getRootHash()
+
+def test_accumulator_root_as_values_arrive(miner):
+    accumulator = miner.MerkleAccumulator()
+    for count, value in enumerate(values(40), 1):
+        accumulator.append(value)
+        assert accumulator.getRootHash() == miner.MerkleTree(values(count)).getRootHash()
+
+def test_empty_accumulator_has_no_root(miner):
+    with pytest.raises(ValueError):
+        miner.MerkleAccumulator().getRootHash()
+
+@pytest.mark.parametrize('count', [1, 2, 3, 7, 8, 9])
+def test_proof_leads_to_root(miner, count):
+    tree = miner.MerkleTree(values(count))
+    for index, value in enumerate(values(count)):
+        node = miner.doubleHash(value.encode())
+        for step in tree.getProof(index):
+            sibling = bytes.fromhex(step['hash'])
+            node = miner.doubleHash(sibling + node if step['position'] == 'left' else node + sibling)
+        assert node.hex() == tree.getRootHash()
@@ -0,0 +1,119 @@
+import pytest
+
+def mine(blockchain, miner_address, transactions=()):
+    # Forge the next block with a reward and the given transactions; proofs are not checked here
+    blockchain.new_reward(miner_address, 50)
+    assert None not in blockchain.new_signed_transactions(list(transactions))
+    return blockchain.new_block(proof=0)
+
+def payment(sender, spends, outputs):
+    return {
+        'sender': sender,
+        'recipient': outputs[0][0],
+        'amount': outputs[0][1],
+        'input_transactions': [{'transaction_hash': transaction_hash, 'index': index} for transaction_hash, index in spends],
+        'output_transactions': [{'recipient': recipient, 'amount': amount} for recipient, amount in outputs],
+    }
+
+def state(utxo_set):
+    return utxo_set.height, utxo_set.outputs, utxo_set.addresses, utxo_set.balances
+
+def rebuilt(miner, blockchain):
+    utxo_set = miner.UtxoSet(blockchain)
+    utxo_set.load()
+    return state(utxo_set)
+
+def reorg(blockchain, fork, blocks):
+    with blockchain.lock:
+        blockchain.chain.truncate(fork)
+        blockchain.chain.extend(blocks)
+        blockchain.notify(fork, blocks)
+
+@pytest.fixture
+def chains(miner):
+    """
+    A chain of genesis, a reward to alice, her payment to carol and carol's payment to dave,
+    and a branch from after the reward in which alice pays erin instead
+    """
+
+    main = miner.Blockchain()
+    reward = mine(main, 'alice')['transaction_hashes'][0]
+    to_carol = mine(main, 'bob', [payment('alice', [(reward, 0)], [('carol', 30), ('alice', 20)])])['transaction_hashes'][1]
+    mine(main, 'carol', [payment('carol', [(to_carol, 0)], [('dave', 30)])])
+
+    branch = miner.Blockchain()
+    with branch.lock:
+        branch.chain.truncate(0)
+        branch.chain.extend(main.chain[:2])
+    mine(branch, 'frank', [payment('alice', [(reward, 0)], [('erin', 50)])])
+    mine(branch, 'frank')
+    mine(branch, 'erin')
+    return main, branch
+
+def test_blocks_are_applied(miner, chains):
+    main, _ = chains
+    utxo_set = miner.UtxoSet(main)
+    utxo_set.load()
+
+    assert utxo_set.height == len(main.chain)
+    assert utxo_set.balance('alice') == {'address': 'alice', 'balance': 20, 'outputs': 1}
+    assert utxo_set.balance('carol') == {'address': 'carol', 'balance': 50, 'outputs': 1}
+    assert utxo_set.balance('dave') == {'address': 'dave', 'balance': 30, 'outputs': 1}
+
+    mine(main, 'dave')
+    assert state(utxo_set) == rebuilt(miner, main)
+    assert utxo_set.balance('dave')['balance'] == 80
+
+def test_reorg_matches_a_rebuild(miner, chains):
+    main, branch = chains
+    utxo_set = miner.UtxoSet(main)
+    utxo_set.load()
+    replaced = main.chain[2:]
+
+    reorg(main, 2, branch.chain[2:])
+    assert state(utxo_set) == rebuilt(miner, main)
+    assert utxo_set.balance('erin')['balance'] == 100
+    assert utxo_set.balance('alice')['balance'] == 0
+    assert utxo_set.balance('dave')['balance'] == 0
+
+    # And back again
+    reorg(main, 2, replaced)
+    assert state(utxo_set) == rebuilt(miner, main)
+    assert utxo_set.balance('erin')['balance'] == 0
+
+def test_reorg_past_the_journal_rebuilds(miner, chains, monkeypatch):
+    main, branch = chains
+    monkeypatch.setattr(miner, 'UNDO_DEPTH', 1)
+    utxo_set = miner.UtxoSet(main)
+    utxo_set.load()
+
+    reorg(main, 2, branch.chain[2:])
+    assert state(utxo_set) == rebuilt(miner, main)
+
+def test_snapshot_matches_a_rebuild(miner, chains, tmp_path):
+    main, branch = chains
+    path = str(tmp_path / 'utxo.json')
+    saved = miner.UtxoSet(main, snapshot_path=path)
+    saved.load()
+    saved.save()
+
+    # Blocks added after the snapshot are applied on load
+    mine(main, 'bob')
+    restored = miner.UtxoSet(main, snapshot_path=path)
+    restored.load()
+    assert state(restored) == rebuilt(miner, main)
+
+    # The journal saved with the snapshot undoes the blocks it covers
+    reorg(main, 2, branch.chain[2:])
+    assert state(restored) == rebuilt(miner, main)
+
+def test_snapshot_off_the_chain_is_ignored(miner, chains, tmp_path):
+    main, branch = chains
+    path = str(tmp_path / 'utxo.json')
+    saved = miner.UtxoSet(branch, snapshot_path=path)
+    saved.load()
+    saved.save()
+
+    restored = miner.UtxoSet(main, snapshot_path=path)
+    restored.load()
+    assert state(restored) == rebuilt(miner, main)
@@ -8,6 +8,7 @@ from urllib.parse import urlparse
 import requests
 from flask import Flask, jsonify, request
 import binascii
+import collections
 from typing import List
 import typing
 import Crypto
@@ -19,12 +20,12 @@ import base64
 import Crypto
 import Crypto.Random
 from Crypto.Hash import SHA
-from Crypto.PublicKey import RSA
-from Crypto.Signature import PKCS1_v1_5
+from Crypto.PublicKey import ECC, RSA
+from Crypto.Signature import PKCS1_v1_5, eddsa
 
 class Blockchain(object):
 
-    def __init__(self, miner):
+    def __init__(self, miner, scheme='rsa'):
         self.current_transactions = []
         self.chain = []
         self.miner = miner
@@ -33,15 +34,15 @@ class Blockchain(object):
         #create the genesis block
         self.new_block(previous_hash = 1, proof = 100) 
         
-        # Generate a Private Key
-        random = Crypto.Random.new().read
-        self.private_key = RSA.generate(1024, random)
+        # Generate a Private Key, with one of SIGNATURE_SCHEMES
+        self.scheme = SIGNATURE_SCHEMES[scheme]
+        self.private_key = self.scheme.generate()
         
         # Generate Public Key
-        self.public_key = self.private_key.publickey()
+        self.public_key = self.scheme.export_public_key(self.private_key)
 
         # Use hash of Public Key as address of the wallet
-        wallet_address = hashlib.sha256(binascii.hexlify(self.public_key.exportKey(format='DER')).decode('ascii').encode()).hexdigest()
+        self.wallet_address = hashlib.sha256(binascii.hexlify(self.public_key).decode('ascii').encode()).hexdigest()
         #a73272175a4c33f4ccc4bd6d565d565a824b90e576e8dbebc2634addf8976d72
 
     def new_block(self, proof, previous_hash=None):
@@ -107,11 +108,21 @@ class Blockchain(object):
     def verify(publickey,data,sign):
         return publickey.verify(data,(int(base64.b64decode(sign)),))
 
-    def send_transaction_to_miner(self, sender_public_key):
+    def send_transaction_to_miner(self, transaction):
+        """
+        Sign a transaction with the wallet's private key and send it to the miner
+        :param transaction: <dict> The transaction, with its recipient, input_transactions and output_transactions
+        :return: <bool> True if the miner received it, False if not
+        """
+
         miner = self.miner
-        signature = sign(self.private_key)
-        print("@", signature)
-        json_obj = {"signature": signature,"transaction": self.current_transactions, "sender": sender_public_key}
+        signature = self.scheme.sign(self.private_key, str(collections.OrderedDict(transaction)).encode('utf8'))
+        json_obj = {
+            "signature": binascii.hexlify(signature).decode('ascii'),
+            "transaction": transaction,
+            "sender": binascii.hexlify(self.public_key).decode('ascii'),
+            "scheme": self.scheme.name,
+        }
         response = requests.post(f'http://{miner}/handle_transaction', json = json_obj)
         if response.status_code == 200:
             return True
@@ -134,6 +145,61 @@ class Blockchain(object):
     def last_block(self):
         return self.chain[-1]
 
+    @staticmethod
+    def valid_merkle_proof(transaction_hash, proof, merkle_root):
+        """
+        Check a Merkle branch from a transaction up to the Merkle root of a block header
+        :param transaction_hash: <str> Hash of the transaction
+        :param proof: <list> The branch, as given by the miner's /transactions/proof
+        :param merkle_root: <str> Merkle root of the block header
+        :return: <bool> True if the transaction is in the block, False if not
+        """
+
+        node = doubleHash(transaction_hash.encode('utf-8'))
+        for sibling in proof:
+            if sibling['position'] == 'left':
+                node = doubleHash(bytes.fromhex(sibling['hash']) + node)
+            else:
+                node = doubleHash(node + bytes.fromhex(sibling['hash']))
+        return node.hex() == merkle_root
+
+    def verify_transaction(self, transaction_hash, height):
+        """
+        Check that a transaction is in a block of the miner's chain. Only the block header and the
+        Merkle branch of the transaction are downloaded, O(log n) hashes instead of the whole chain
+        :param transaction_hash: <str> Hash of the transaction
+        :param height: <int> Height of the block that holds it
+        :return: <bool> True if the transaction is in the block, False if not
+        """
+
+        miner = self.miner
+        response = requests.get(f'http://{miner}/chain', params={'start': height, 'end': height + 1, 'headers': 1})
+        if response.status_code != 200:
+            return False
+        headers = response.json()['chain']
+        if not headers:
+            return False
+
+        response = requests.get(f'http://{miner}/transactions/proof', params={'height': height, 'hash': transaction_hash})
+        if response.status_code != 200:
+            return False
+
+        return self.valid_merkle_proof(transaction_hash, response.json()['proof'], headers[0]['merkle_root'])
+
+    def refresh_wallet(self):
+        """
+        Fill the wallet with the unspent outputs of its address, looked up in the miner's UTXO set
+        :return: <list> The unspent outputs, in UTXO format, or None if the miner did not answer
+        """
+
+        miner = self.miner
+        response = requests.get(f'http://{miner}/balance/{self.wallet_address}', params={'outputs': 1})
+        if response.status_code != 200:
+            return None
+
+        self.wallet = response.json()['unspent']
+        return self.wallet
+
     def valid_chain(self, chain):
         """
         Determine if a given blockchain is valid
@@ -164,53 +230,124 @@ class Blockchain(object):
 
 
 # Implementing the Merkle Root Tree
-class Node:
-    def __init__(self, left, right, value: str)-> None:
-        self.left: Node = left
-        self.right: Node = right
-        self.value = value
-
-    @staticmethod
-    def hash(val: str)-> str:
-        return hashlib.sha256(val.encode('utf-8')).hexdigest()
-
-    @staticmethod
-    def doubleHash(val: str)-> str:
-        return Node.hash(Node.hash(val))
+def doubleHash(data: bytes)-> bytes:
+    return hashlib.sha256(hashlib.sha256(data).digest()).digest()
 
 class MerkleTree:
+    """
+    Merkle Tree built level by level, without recursion. Each level is a contiguous
+    buffer of 32 byte digests, from the leaves up to the root, and the last node of
+    an odd level is paired with itself
+    """
+
     def __init__(self, values: List[str])-> None:
+        if not values:
+            raise ValueError("A Merkle Tree needs at least one value")
         self.__buildTree(values)
 
     def __buildTree(self, values: List[str])-> None:
-        leaves: List[Node] = [Node(None, None, Node.doubleHash(e)) for e in values]
-        if len(leaves) % 2 == 1:
-            leaves.append(leaves[-1:][0]) # duplicate last elem if odd number of elements
-        self.root: Node = self.__buildTreeRec(leaves)
+        level = bytearray(32 * len(values))
+        for i, e in enumerate(values):
+            level[32 * i:32 * i + 32] = doubleHash(e.encode('utf-8'))
+        self.levels: List[bytearray] = [level]
+
+        while len(level) > 32 or len(self.levels) == 1:
+            nodes = memoryview(level)
+            if len(level) % 64:
+                nodes = memoryview(level + level[-32:]) # duplicate last elem if odd number of elements
+            level = bytearray(len(nodes) // 2)
+            for i in range(0, len(nodes), 64):
+                level[i // 2:i // 2 + 32] = doubleHash(nodes[i:i + 64])
+            self.levels.append(level)
 
-    def __buildTreeRec(self, nodes: List[Node])-> Node:
-        half: int = len(nodes) // 2
+    def printTree(self)-> None:
+        for level in reversed(self.levels):
+            for i in range(0, len(level), 32):
+                print(level[i:i + 32].hex())
 
-        if len(nodes) == 2:
-            return Node(nodes[0], nodes[1], Node.doubleHash(nodes[0].value + nodes[1].value))
+    def getRootHash(self)-> str:
+        return self.levels[-1].hex()
 
-        left: Node = self.__buildTreeRec(nodes[:half])
-        right: Node = self.__buildTreeRec(nodes[half:])
-        value: str = Node.doubleHash(left.value + right.value)
-        return Node(left, right, value)
+    def getProof(self, index: int)-> List[dict]:
+        """
+        The Merkle branch of a leaf: the sibling of each node on its path to the root
+        :param index: <int> Position of the leaf
+        :return: <list> The siblings, from the leaves up, with the side they are on
+        """
 
-    def printTree(self)-> None:
-        self.__printTreeRec(self.root)
+        proof = []
+        for level in self.levels[:-1]:
+            sibling = index ^ 1
+            if 32 * sibling >= len(level):
+                sibling = index # the last elem of an odd level is paired with itself
+            proof.append({
+                'hash': level[32 * sibling:32 * sibling + 32].hex(),
+                'position': 'left' if sibling < index else 'right',
+            })
+            index //= 2
+        return proof
+    
+# Signature schemes for wallets. A signed transaction names its scheme, RSA if it does not
+class RSAScheme:
+    """
+    1024 bit RSA with PKCS#1 v1.5 signatures over SHA-1, kept for compatibility with older wallets
+    """
 
-    def __printTreeRec(self, node)-> None:
-        if node != None:
-            print(node.value)
-            self.__printTreeRec(node.left)
-            self.__printTreeRec(node.right)
+    name = 'rsa'
+
+    @staticmethod
+    def generate():
+        return RSA.generate(1024, Crypto.Random.new().read)
+
+    @staticmethod
+    def export_public_key(private_key)-> bytes:
+        return private_key.publickey().exportKey(format='DER')
+
+    @staticmethod
+    def sign(private_key, message: bytes)-> bytes:
+        return PKCS1_v1_5.new(private_key).sign(SHA.new(message))
+
+    @staticmethod
+    def verifier(public_key: bytes):
+        # A function checking signatures of messages against the public key, ValueError if the key is malformed
+        verifier = PKCS1_v1_5.new(RSA.importKey(public_key))
+        return lambda message, signature: verifier.verify(SHA.new(message), signature)
+
+class Ed25519Scheme:
+    """
+    Ed25519 signatures: keys are quick to generate, and signatures are smaller and faster to verify than RSA's
+    """
+
+    name = 'ed25519'
+
+    @staticmethod
+    def generate():
+        return ECC.generate(curve='ed25519')
+
+    @staticmethod
+    def export_public_key(private_key)-> bytes:
+        return private_key.public_key().export_key(format='DER')
+
+    @staticmethod
+    def sign(private_key, message: bytes)-> bytes:
+        return eddsa.new(private_key, 'rfc8032').sign(message)
+
+    @staticmethod
+    def verifier(public_key: bytes):
+        # A function checking signatures of messages against the public key, ValueError if the key is malformed
+        verifier = eddsa.new(ECC.import_key(public_key), 'rfc8032')
+
+        def verify(message, signature):
+            try:
+                verifier.verify(message, signature)
+            except ValueError:
+                return False
+            return True
+
+        return verify
+
+SIGNATURE_SCHEMES = {scheme.name: scheme for scheme in (RSAScheme, Ed25519Scheme)}
 
-    def getRootHash(self)-> str:
-        return self.root.value
-    
 # instantiate our node
 app = Flask(__name__)
 
@@ -244,6 +381,29 @@ def full_chain():
 
     return jsonify(response), 200
 
+@app.route('/transactions/verify', methods=['GET'])
+def verify_transaction():
+    height = request.args.get('height', type=int)
+    transaction_hash = request.args.get('hash')
+    if height is None or transaction_hash is None:
+        return 'Missing values', 400
+
+    response = {'verified': blockchain.verify_transaction(transaction_hash, height)}
+    return jsonify(response), 200
+
+@app.route('/wallet', methods=['GET'])
+def wallet():
+    unspent = blockchain.refresh_wallet()
+    if unspent is None:
+        return 'The miner did not answer', 502
+
+    response = {
+        'address': blockchain.wallet_address,
+        'balance': sum(output['amount'] for output in unspent),
+        'unspent': unspent,
+    }
+    return jsonify(response), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5005)
 